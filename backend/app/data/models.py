@@ -11,9 +11,14 @@
       - Село (население)
       - Деревня (население)
       - Заимка (население)
+
+Населенных пунктов десятки тысяч, поэтому Settlement, UrbanDistrict, Region
+и FederalDistrict - dataclass со __slots__ (без __dict__ у каждого объекта);
+названия при загрузке интернируются (sys.intern), тип - общий член SettlementType.
 """
 
-from typing import List, Optional, Dict, Any
+from types import MappingProxyType
+from typing import List, Optional, Dict, Any, Mapping, Tuple
 from dataclasses import dataclass, field
 from enum import Enum
 
@@ -29,7 +34,12 @@ class SettlementType(str, Enum):
     WORKING_SETTLEMENT = "рабочий поселок"  # Рабочий поселок
 
 
-@dataclass
+def normalize_name(name: str) -> str:
+    """Нормализованное название для поиска (без учета регистра)"""
+    return name.lower()
+
+
+@dataclass(slots=True)
 class Settlement:
     """Населенный пункт"""
     name: str  # Название
@@ -47,7 +57,7 @@ class Settlement:
         }
 
 
-@dataclass
+@dataclass(slots=True)
 class UrbanDistrict:
     """Городской округ"""
     name: str  # Название округа
@@ -68,7 +78,7 @@ class UrbanDistrict:
         return self.population
 
 
-@dataclass
+@dataclass(slots=True)
 class Region:
     """Регион (субъект РФ)"""
     id: str  # Код региона (01-99)
@@ -97,7 +107,7 @@ class Region:
         return self.population
 
 
-@dataclass
+@dataclass(slots=True)
 class FederalDistrict:
     """Федеральный округ"""
     name: str  # Название округа
@@ -120,8 +130,83 @@ class FederalDistrict:
 
 @dataclass
 class RussiaData:
-    """Полная структура данных России"""
+    """Полная структура данных России
+
+    Поиск выполняется по индексам (словарям), построенным build_indexes().
+    Индексы строятся при создании объекта и при загрузке данных; после
+    изменения federal_districts их нужно перестроить.
+
+    Там же один раз считается население регионов и федеральных округов
+    (region_populations, federal_district_populations - неизменяемые словари),
+    поэтому запросы населения не обходят населенные пункты.
+    """
     federal_districts: List[FederalDistrict] = field(default_factory=list)
+    # Индексы поиска: регион по ID, населенный пункт по (ID региона, названию)
+    # и по ID, городской округ по (ID региона, названию)
+    _regions_by_id: Dict[str, Region] = field(default_factory=dict, init=False, repr=False, compare=False)
+    _settlements_by_name: Dict[Tuple[str, str], Settlement] = field(
+        default_factory=dict, init=False, repr=False, compare=False
+    )
+    _settlements_by_id: Dict[str, Settlement] = field(default_factory=dict, init=False, repr=False, compare=False)
+    _urban_districts_by_name: Dict[Tuple[str, str], UrbanDistrict] = field(
+        default_factory=dict, init=False, repr=False, compare=False
+    )
+    # Население по населенным пунктам: {ID региона: население}, {название округа: население}
+    _region_populations: Dict[str, int] = field(default_factory=dict, init=False, repr=False, compare=False)
+    _federal_district_populations: Dict[str, int] = field(
+        default_factory=dict, init=False, repr=False, compare=False
+    )
+    # Те же словари только для чтения
+    region_populations: Mapping[str, int] = field(
+        default_factory=lambda: MappingProxyType({}), init=False, repr=False, compare=False
+    )
+    federal_district_populations: Mapping[str, int] = field(
+        default_factory=lambda: MappingProxyType({}), init=False, repr=False, compare=False
+    )
+
+    def __post_init__(self):
+        self.build_indexes()
+
+    def build_indexes(self):
+        """Построить индексы поиска и посчитать население по текущим данным"""
+        self._regions_by_id = {}
+        self._settlements_by_name = {}
+        self._settlements_by_id = {}
+        self._urban_districts_by_name = {}
+        self._region_populations = {}
+        self._federal_district_populations = {}
+        self.region_populations = MappingProxyType(self._region_populations)
+        self.federal_district_populations = MappingProxyType(self._federal_district_populations)
+        for district in self.federal_districts:
+            self._index_district(district)
+
+    def _index_district(self, district: FederalDistrict):
+        """Добавить федеральный округ в индексы"""
+        district_population = 0
+        for region in district.regions:
+            # Как Region.calculate_population, но без изменения объектов
+            population = sum(c.population for c in region.cities) + sum(
+                s.population for ud in region.urban_districts for s in ud.settlements
+            )
+            district_population += population
+            # При повторе ID используется первый регион (как при переборе)
+            if region.id in self._regions_by_id:
+                continue
+            # Города региона приоритетнее одноименных населенных пунктов округов
+            settlements = list(region.cities)
+            for urban_district in region.urban_districts:
+                self._urban_districts_by_name.setdefault(
+                    (region.id, normalize_name(urban_district.name)), urban_district
+                )
+                settlements.extend(urban_district.settlements)
+            for settlement in settlements:
+                self._settlements_by_name.setdefault((region.id, normalize_name(settlement.name)), settlement)
+                if settlement.id:
+                    self._settlements_by_id.setdefault(settlement.id, settlement)
+            self._region_populations[region.id] = population
+            # Регион публикуется последним: найденный регион уже проиндексирован целиком
+            self._regions_by_id[region.id] = region
+        self._federal_district_populations.setdefault(district.name, district_population)
     
     def to_dict(self) -> Dict[str, Any]:
         """Преобразовать в словарь"""
@@ -131,33 +216,29 @@ class RussiaData:
     
     def get_region_by_id(self, region_id: str) -> Optional[Region]:
         """Найти регион по ID"""
-        for district in self.federal_districts:
-            for region in district.regions:
-                if region.id == region_id:
-                    return region
-        return None
+        return self._regions_by_id.get(region_id)
     
     def get_settlement_by_name(self, region_id: str, settlement_name: str) -> Optional[Settlement]:
-        """Найти населенный пункт по имени в регионе"""
-        region = self.get_region_by_id(region_id)
-        if not region:
-            return None
-        
-        # Ищем в городах
-        for city in region.cities:
-            if city.name.lower() == settlement_name.lower():
-                return city
-        
-        # Ищем в городских округах
-        for district in region.urban_districts:
-            for settlement in district.settlements:
-                if settlement.name.lower() == settlement_name.lower():
-                    return settlement
-        
-        return None
+        """Найти населенный пункт по имени в регионе (сначала среди городов региона)"""
+        return self._settlements_by_name.get((region_id, normalize_name(settlement_name)))
+    
+    def get_settlement_by_id(self, settlement_id: str) -> Optional[Settlement]:
+        """Найти населенный пункт по ID"""
+        return self._settlements_by_id.get(settlement_id)
+    
+    def get_urban_district_by_name(self, region_id: str, district_name: str) -> Optional[UrbanDistrict]:
+        """Найти городской округ по имени в регионе"""
+        return self._urban_districts_by_name.get((region_id, normalize_name(district_name)))
+    
+    def get_region_population(self, region_id: str) -> int:
+        """Население региона по населенным пунктам (0, если регион не найден)"""
+        return self._region_populations.get(region_id, 0)
+    
+    def get_federal_district_population(self, district_name: str) -> int:
+        """Население федерального округа по населенным пунктам (0, если округ не найден)"""
+        return self._federal_district_populations.get(district_name, 0)
     
     def calculate_all_populations(self):
         """Пересчитать все население"""
         for district in self.federal_districts:
             district.calculate_population()
-
@@ -128,6 +128,24 @@ def get_city_population(region_id: str, city_name: str) -> int:
         return 0
 
 
+def get_district_population(region_id: str, district_name: str) -> int:
+    """
+    Получить население района города (городского округа)
+    
+    Args:
+        region_id: ID региона
+        district_name: Название района
+    
+    Returns:
+        Население района или 0, если район не найден
+    """
+    try:
+        from .russia_settlements import get_urban_district_population
+        return get_urban_district_population(region_id, district_name)
+    except ImportError:
+        return 0
+
+
 def get_federal_district_population(district_name: str) -> int:
     """
     Получить население федерального округа (сумма населения всех регионов)
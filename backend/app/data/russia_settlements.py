@@ -17,11 +17,86 @@
 ВНИМАНИЕ: Это шаблон структуры. Реальные данные нужно заполнить из RuWiki.
 """
 
-from typing import Dict, Any
+import gc
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from sys import intern
+from typing import Dict, Any, List, Optional, Tuple
 from .models import (
     RussiaData, FederalDistrict, Region, UrbanDistrict, 
     Settlement, SettlementType
 )
+from .settlements_snapshot import read_snapshot
+
+# Загружать все данные при старте приложения (иначе - по округам при первом обращении)
+SETTLEMENTS_PRELOAD = os.getenv("SETTLEMENTS_PRELOAD", "off") == "on"
+
+# Список федеральных округов
+FEDERAL_DISTRICTS = [
+    "Центральный",
+    "Северо-Западный",
+    "Южный",
+    "Северо-Кавказский",
+    "Приволжский",
+    "Уральский",
+    "Сибирский",
+    "Дальневосточный"
+]
+
+# Маппинг русских названий на безопасные имена файлов
+DISTRICT_FILENAMES = {
+    'Центральный': 'central.json',
+    'Северо-Западный': 'northwest.json',
+    'Южный': 'south.json',
+    'Северо-Кавказский': 'north_caucasus.json',
+    'Приволжский': 'volga.json',
+    'Уральский': 'ural.json',
+    'Сибирский': 'siberian.json',
+    'Дальневосточный': 'far_east.json'
+}
+
+# Коды регионов федеральных округов (для ленивой загрузки: какой файл читать для региона)
+FEDERAL_DISTRICT_REGIONS = {
+    'Центральный': ['31', '32', '33', '36', '37', '40', '44', '46', '48', '50', '57', '62', '67', '68', '69',
+                    '71', '76', '77'],
+    'Северо-Западный': ['10', '11', '29', '35', '39', '47', '51', '53', '60', '78', '83'],
+    'Южный': ['01', '08', '23', '30', '34', '61', '90', '91', '92', '93', '94', '95', '99'],
+    'Северо-Кавказский': ['05', '06', '07', '09', '15', '20', '26'],
+    'Приволжский': ['02', '12', '13', '16', '18', '21', '43', '52', '56', '58', '59', '63', '64', '73'],
+    'Уральский': ['45', '66', '72', '74', '86', '89'],
+    'Сибирский': ['04', '17', '19', '22', '24', '38', '42', '54', '55', '70'],
+    'Дальневосточный': ['03', '14', '25', '27', '28', '41', '49', '65', '75', '79', '87']
+}
+
+# ID региона -> федеральный округ
+REGION_FEDERAL_DISTRICTS = {
+    region_id: district_name
+    for district_name, region_ids in FEDERAL_DISTRICT_REGIONS.items()
+    for region_id in region_ids
+}
+
+DATA_DIR = Path(__file__).resolve().parent
+DISTRICTS_DIR = DATA_DIR / 'districts'
+# Бинарный снимок districts/*.json (scripts/build_settlements_snapshot.py)
+SNAPSHOT_FILE = DATA_DIR / 'settlements.snapshot'
+
+
+def freeze_loaded_objects():
+    """
+    Исключить загруженные объекты из обхода сборщика мусора
+
+    Десятки тысяч объектов справочника живут до конца процесса; после
+    gc.freeze() сборщик их больше не просматривает.
+
+    Вызывается один раз при старте (preload_russia_data): полная сборка
+    останавливает цикл событий, а gc.freeze() навсегда оставляет в памяти
+    и объекты обрабатываемых в этот момент запросов.
+    """
+    gc.collect()
+    gc.freeze()
 
 
 def create_empty_structure() -> RussiaData:
@@ -32,20 +107,8 @@ def create_empty_structure() -> RussiaData:
     """
     data = RussiaData()
     
-    # Список федеральных округов
-    federal_districts = [
-        "Центральный",
-        "Северо-Западный",
-        "Южный",
-        "Северо-Кавказский",
-        "Приволжский",
-        "Уральский",
-        "Сибирский",
-        "Дальневосточный"
-    ]
-    
     # Создаем структуру федеральных округов
-    for district_name in federal_districts:
+    for district_name in FEDERAL_DISTRICTS:
         district = FederalDistrict(
             name=district_name,
             population=0,
@@ -53,6 +116,7 @@ def create_empty_structure() -> RussiaData:
         )
         data.federal_districts.append(district)
     
+    data.build_indexes()
     return data
 
 
@@ -67,7 +131,7 @@ def _load_district_from_json(district_data: Dict[str, Any]) -> FederalDistrict:
         Объект FederalDistrict
     """
     district = FederalDistrict(
-        name=district_data['name'],
+        name=intern(district_data['name']),
         population=district_data.get('population', 0),
         regions=[]
     )
@@ -75,10 +139,10 @@ def _load_district_from_json(district_data: Dict[str, Any]) -> FederalDistrict:
     # Добавляем регионы
     for region_data in district_data.get('regions', []):
         region = Region(
-            id=region_data['id'],
-            name=region_data['name'],
+            id=intern(region_data['id']),
+            name=intern(region_data['name']),
             population=region_data.get('population', 0),
-            federal_district=region_data.get('federal_district', district_data['name']),
+            federal_district=intern(region_data.get('federal_district', district_data['name'])),
             cities=[],
             urban_districts=[]
         )
@@ -94,7 +158,7 @@ def _load_district_from_json(district_data: Dict[str, Any]) -> FederalDistrict:
                 settlement_type = SettlementType.CITY
             
             city = Settlement(
-                name=city_data['name'],
+                name=intern(city_data['name']),
                 type=settlement_type,
                 population=city_data.get('population', 0),
                 id=city_data.get('id')
@@ -104,7 +168,7 @@ def _load_district_from_json(district_data: Dict[str, Any]) -> FederalDistrict:
         # Добавляем городские округа
         for district_data_item in region_data.get('urban_districts', []):
             urban_district = UrbanDistrict(
-                name=district_data_item['name'],
+                name=intern(district_data_item['name']),
                 population=district_data_item.get('population', 0),
                 settlements=[]
             )
@@ -113,13 +177,13 @@ def _load_district_from_json(district_data: Dict[str, Any]) -> FederalDistrict:
             for settlement_data in district_data_item.get('settlements', []):
                 try:
                     settlement = Settlement(
-                        name=settlement_data['name'],
+                        name=intern(settlement_data['name']),
                         type=SettlementType(settlement_data['type']),
                         population=settlement_data.get('population', 0),
                         id=settlement_data.get('id')
                     )
                     urban_district.settlements.append(settlement)
-                except (ValueError, KeyError) as e:
+                except (ValueError, KeyError, TypeError) as e:
                     # Пропускаем некорректные данные
                     continue
             
@@ -130,75 +194,71 @@ def _load_district_from_json(district_data: Dict[str, Any]) -> FederalDistrict:
     return district
 
 
+def district_files() -> List[Tuple[str, Path]]:
+    """
+    Найденные файлы федеральных округов в папке districts
+
+    Returns:
+        [(название округа, путь к JSON)] в порядке FEDERAL_DISTRICTS
+    """
+    files = []
+    if not DISTRICTS_DIR.is_dir():
+        return files
+    for district_name in FEDERAL_DISTRICTS:
+        # Используем безопасное имя файла
+        safe_filename = DISTRICT_FILENAMES.get(district_name, f"{district_name}.json")
+        district_file = DISTRICTS_DIR / safe_filename
+        
+        # Пробуем сначала безопасное имя, потом русское (для обратной совместимости)
+        if not district_file.exists():
+            district_file = DISTRICTS_DIR / f"{district_name}.json"
+        
+        if district_file.exists():
+            files.append((district_name, district_file))
+    return files
+
+
+def load_districts_from_json(files: List[Tuple[str, Path]]) -> List[FederalDistrict]:
+    """Загрузить федеральные округа из JSON (файлы с ошибками пропускаются)"""
+    districts = []
+    for _, district_file in files:
+        try:
+            with open(district_file, 'r', encoding='utf-8') as f:
+                district_data = json.load(f)
+            
+            districts.append(_load_district_from_json(district_data))
+        except Exception as e:
+            print(f"[WARNING] Ошибка при загрузке {district_file}: {e}")
+            continue
+    return districts
+
+
 def load_russia_data() -> RussiaData:
     """
     Загрузить данные о населенных пунктах России
     
-    Сначала пытается загрузить из файлов по округам (districts/*.json),
+    Сначала пытается загрузить из файлов по округам (districts/*.json) -
+    из их бинарного снимка, если он актуален, иначе из самих JSON;
     если не найдено - загружает из старого файла settlements_data.json
     """
-    import json
-    from pathlib import Path
-    
-    # Маппинг русских названий на безопасные имена файлов
-    DISTRICT_FILENAMES = {
-        'Центральный': 'central.json',
-        'Северо-Западный': 'northwest.json',
-        'Южный': 'south.json',
-        'Северо-Кавказский': 'north_caucasus.json',
-        'Приволжский': 'volga.json',
-        'Уральский': 'ural.json',
-        'Сибирский': 'siberian.json',
-        'Дальневосточный': 'far_east.json'
-    }
-    
     data = RussiaData()
-    data_dir = Path(__file__).parent
-    districts_dir = data_dir / 'districts'
-    
-    # Список федеральных округов
-    federal_districts = [
-        "Центральный",
-        "Северо-Западный",
-        "Южный",
-        "Северо-Кавказский",
-        "Приволжский",
-        "Уральский",
-        "Сибирский",
-        "Дальневосточный"
-    ]
     
     # Пытаемся загрузить из файлов по округам
-    if districts_dir.exists() and districts_dir.is_dir():
-        loaded_count = 0
-        for district_name in federal_districts:
-            # Используем безопасное имя файла
-            safe_filename = DISTRICT_FILENAMES.get(district_name, f"{district_name}.json")
-            district_file = districts_dir / safe_filename
-            
-            # Пробуем сначала безопасное имя, потом русское (для обратной совместимости)
-            if not district_file.exists():
-                district_file = districts_dir / f"{district_name}.json"
-            
-            if district_file.exists():
-                try:
-                    with open(district_file, 'r', encoding='utf-8') as f:
-                        district_data = json.load(f)
-                    
-                    district = _load_district_from_json(district_data)
-                    data.federal_districts.append(district)
-                    loaded_count += 1
-                except Exception as e:
-                    print(f"[WARNING] Ошибка при загрузке {district_file}: {e}")
-                    continue
+    files = district_files()
+    if files:
+        districts = read_snapshot(SNAPSHOT_FILE, files)
+        if districts is None:
+            districts = load_districts_from_json(files)
         
-        if loaded_count > 0:
+        if districts:
+            data.federal_districts.extend(districts)
             # Пересчитываем население
             data.calculate_all_populations()
+            data.build_indexes()
             return data
     
     # Если файлы по округам не найдены, пытаемся загрузить из старого файла
-    json_file = data_dir / 'settlements_data.json'
+    json_file = DATA_DIR / 'settlements_data.json'
     
     if json_file.exists():
         try:
@@ -212,6 +272,7 @@ def load_russia_data() -> RussiaData:
             
             # Пересчитываем население
             data.calculate_all_populations()
+            data.build_indexes()
             return data
         except Exception as e:
             print(f"[ERROR] Ошибка при загрузке данных из {json_file}: {e}")
@@ -221,16 +282,205 @@ def load_russia_data() -> RussiaData:
     return create_empty_structure()
 
 
+class LazyRussiaData(RussiaData):
+    """
+    Данные, загружаемые по федеральным округам при первом обращении
+
+    Файл округа (из снимка или JSON) читается при первом поиске в одном
+    из его регионов (REGION_FEDERAL_DISTRICTS). Все еще не загруженные
+    округа загружаются, только если регион неизвестен (нет в
+    REGION_FEDERAL_DISTRICTS); регион известного округа без файла данных
+    просто не находится. Поиск по ID населенного пункта и to_dict
+    загружают все.
+
+    Потокобезопасно: каждый округ загружается один раз, параллельные
+    запросы к тому же округу ждут окончания его загрузки.
+    """
+
+    def __init__(self, files: List[Tuple[str, Path]]):
+        super().__init__()
+        self._files = files
+        self._order = {name: index for index, (name, _) in enumerate(files)}
+        # Еще не загруженные округа и их блокировки
+        self._pending: Dict[str, threading.Lock] = {name: threading.Lock() for name, _ in files}
+        self._index_lock = threading.Lock()
+        self._use_snapshot = True
+        # Суммарное время загрузки округов, секунды
+        self.load_seconds = 0.0
+
+    @property
+    def fully_loaded(self) -> bool:
+        return not self._pending
+
+    @property
+    def pending_count(self) -> int:
+        """Сколько округов еще не загружено"""
+        return len(self._pending)
+
+    def _load_district(self, name: str) -> Optional[FederalDistrict]:
+        if self._use_snapshot:
+            districts = read_snapshot(SNAPSHOT_FILE, self._files, [name])
+            if districts:
+                return districts[0]
+            # Снимка нет или он не подходит - дальше читаем только JSON
+            self._use_snapshot = False
+        districts = load_districts_from_json([file for file in self._files if file[0] == name])
+        return districts[0] if districts else None
+
+    def ensure_district(self, name: str):
+        """Загрузить федеральный округ, если он еще не загружен"""
+        lock = self._pending.get(name)
+        if lock is None:
+            return
+        with lock:
+            if name not in self._pending:
+                return
+            started = time.perf_counter()
+            district = self._load_district(name)
+            with self._index_lock:
+                if district is not None:
+                    district.calculate_population()
+                    self._index_district(district)
+                    # Список заменяется целиком: читатели видят его старую или новую версию
+                    self.federal_districts = sorted(
+                        self.federal_districts + [district],
+                        key=lambda item: self._order.get(item.name, len(self._order))
+                    )
+                del self._pending[name]
+            elapsed = time.perf_counter() - started
+            with self._index_lock:
+                self.load_seconds += elapsed
+            print(f"[INFO] Федеральный округ {name} загружен за {elapsed:.2f} с")
+
+    def ensure_region(self, region_id: str):
+        """Загрузить федеральный округ региона (все округа, если регион неизвестен)"""
+        if region_id in self._regions_by_id or not self._pending:
+            return
+        district_name = REGION_FEDERAL_DISTRICTS.get(region_id)
+        if district_name is None:
+            self.load_all()
+            return
+        # Округа без файла данных нет в _pending: регион не найдется и после
+        # загрузки остальных округов, поэтому они не загружаются
+        self.ensure_district(district_name)
+
+    def load_all(self):
+        """Загрузить все еще не загруженные округа"""
+        for name in list(self._pending):
+            self.ensure_district(name)
+
+    def to_dict(self) -> Dict[str, Any]:
+        self.load_all()
+        return super().to_dict()
+
+    def get_region_by_id(self, region_id: str) -> Optional[Region]:
+        self.ensure_region(region_id)
+        return super().get_region_by_id(region_id)
+
+    def get_settlement_by_name(self, region_id: str, settlement_name: str) -> Optional[Settlement]:
+        self.ensure_region(region_id)
+        return super().get_settlement_by_name(region_id, settlement_name)
+
+    def get_settlement_by_id(self, settlement_id: str) -> Optional[Settlement]:
+        self.load_all()
+        return super().get_settlement_by_id(settlement_id)
+
+    def get_urban_district_by_name(self, region_id: str, district_name: str) -> Optional[UrbanDistrict]:
+        self.ensure_region(region_id)
+        return super().get_urban_district_by_name(region_id, district_name)
+
+    def get_region_population(self, region_id: str) -> int:
+        self.ensure_region(region_id)
+        return super().get_region_population(region_id)
+
+    def get_federal_district_population(self, district_name: str) -> int:
+        if district_name in self._pending:
+            self.ensure_district(district_name)
+        elif district_name not in self._federal_district_populations and district_name not in FEDERAL_DISTRICT_REGIONS:
+            self.load_all()
+        return super().get_federal_district_population(district_name)
+
+
+def create_russia_data() -> RussiaData:
+    """
+    Данные для процесса: с ленивой загрузкой по округам, если есть файлы
+    districts/*.json, иначе полностью загруженные (load_russia_data)
+    """
+    files = district_files()
+    if files:
+        return LazyRussiaData(files)
+    return load_russia_data()
+
+
 # Глобальный экземпляр данных (ленивая загрузка)
 _russia_data: RussiaData | None = None
+# Создание и замена _russia_data - под блокировкой: при одновременных
+# первых запросах данные создаются один раз, остальные ждут
+_russia_data_lock = threading.Lock()
+# Время создания _russia_data, секунды
+_russia_data_init_seconds = 0.0
+
+
+def _set_russia_data() -> RussiaData:
+    global _russia_data, _russia_data_init_seconds
+    started = time.perf_counter()
+    data = create_russia_data()
+    _russia_data_init_seconds = time.perf_counter() - started
+    _russia_data = data
+    return data
 
 
 def get_russia_data() -> RussiaData:
     """Получить данные о населенных пунктах России (с кэшированием)"""
-    global _russia_data
-    if _russia_data is None:
-        _russia_data = load_russia_data()
-    return _russia_data
+    data = _russia_data
+    if data is None:
+        with _russia_data_lock:
+            data = _russia_data
+            if data is None:
+                data = _set_russia_data()
+    return data
+
+
+def reload_russia_data() -> RussiaData:
+    """Перечитать данные (индексы и население пересчитываются при загрузке)"""
+    with _russia_data_lock:
+        return _set_russia_data()
+
+
+def preload_russia_data() -> float:
+    """
+    Загрузить данные целиком (вызывается при старте приложения)
+
+    После загрузки объекты справочника исключаются из обхода сборщика
+    мусора (freeze_loaded_objects) - до приема первых запросов.
+
+    Returns:
+        Длительность загрузки в секундах
+    """
+    started = time.perf_counter()
+    data = get_russia_data()
+    if isinstance(data, LazyRussiaData):
+        data.load_all()
+    freeze_loaded_objects()
+    elapsed = time.perf_counter() - started
+    print(f"[INFO] Данные о населенных пунктах загружены за {elapsed:.2f} с "
+          f"(федеральных округов: {len(data.federal_districts)})")
+    return elapsed
+
+
+def russia_data_stats() -> dict:
+    """Метрики загрузки данных для /api/health"""
+    data = _russia_data
+    if data is None:
+        return {"loaded": False, "federalDistricts": 0, "pendingFederalDistricts": None, "loadSeconds": 0.0}
+    pending = data.pending_count if isinstance(data, LazyRussiaData) else 0
+    load_seconds = _russia_data_init_seconds + getattr(data, "load_seconds", 0.0)
+    return {
+        "loaded": pending == 0,
+        "federalDistricts": len(data.federal_districts),
+        "pendingFederalDistricts": pending,
+        "loadSeconds": round(load_seconds, 3),
+    }
 
 
 def get_settlement_population(region_id: str, settlement_name: str) -> int:
@@ -259,12 +509,23 @@ def get_region_population_from_settlements(region_id: str) -> int:
     Returns:
         Население региона или 0, если не найден
     """
+    return get_russia_data().get_region_population(region_id)
+
+
+def get_urban_district_population(region_id: str, district_name: str) -> int:
+    """
+    Получить население городского округа (района) региона
+    
+    Args:
+        region_id: ID региона
+        district_name: Название округа/района
+    
+    Returns:
+        Население округа или 0, если не найден
+    """
     data = get_russia_data()
-    region = data.get_region_by_id(region_id)
-    if region:
-        region.calculate_population()
-        return region.population
-    return 0
+    district = data.get_urban_district_by_name(region_id, district_name)
+    return district.population if district else 0
 
 
 def get_federal_district_population(district_name: str) -> int:
@@ -277,10 +538,5 @@ def get_federal_district_population(district_name: str) -> int:
     Returns:
         Население округа или 0, если не найден
     """
-    data = get_russia_data()
-    for district in data.federal_districts:
-        if district.name == district_name:
-            district.calculate_population()
-            return district.population
-    return 0
+    return get_russia_data().get_federal_district_population(district_name)
 
@@ -0,0 +1,225 @@
+"""
+Бинарный снимок данных о населенных пунктах
+
+Снимок собирается скриптом scripts/build_settlements_snapshot.py из
+файлов districts/*.json и читается вместо них при загрузке: разбор
+marshal в разы быстрее json.load и построения объектов из словарей.
+
+Формат файла:
+- префикс: сигнатура, версия формата, длина и CRC32 заголовка
+- заголовок (marshal): версия Python, отпечаток исходных JSON
+  (имя, размер, mtime_ns каждого файла) и оглавление - для каждого
+  федерального округа смещение, длина и CRC32 его данных
+- данные округов (marshal): вложенные кортежи без имен полей
+
+Файл читается через mmap. Снимок не используется (загрузка идет из JSON),
+если его нет, он собран другой версией Python или формата, исходные JSON
+изменились после сборки или не сходится контрольная сумма.
+"""
+
+import marshal
+import mmap
+import os
+import struct
+import sys
+from sys import intern
+import zlib
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+from .models import FederalDistrict, Region, UrbanDistrict, Settlement, SettlementType
+
+SNAPSHOT_MAGIC = b"HRSETTLS"
+SNAPSHOT_FORMAT_VERSION = 1
+# Сигнатура, версия формата, длина заголовка, CRC32 заголовка
+_PREFIX = struct.Struct("<8sHII")
+
+_SETTLEMENT_TYPES = {settlement_type.value: settlement_type for settlement_type in SettlementType}
+
+
+class SnapshotError(Exception):
+    """Снимок поврежден или не подходит для этого процесса"""
+
+
+def _python_tag() -> str:
+    """Версия Python и marshal, которыми собран снимок"""
+    return f"{sys.implementation.cache_tag}/marshal{marshal.version}"
+
+
+def source_fingerprint(files: Sequence[Tuple[str, Path]]) -> List[List[Any]]:
+    """Отпечаток исходных JSON: [[имя файла, размер, mtime_ns]]"""
+    fingerprint = []
+    for _, path in files:
+        stat = path.stat()
+        fingerprint.append([path.name, stat.st_size, stat.st_mtime_ns])
+    return fingerprint
+
+
+def _encode_settlement(settlement: Settlement) -> tuple:
+    return (settlement.name, settlement.type.value, settlement.population, settlement.id)
+
+
+def _encode_district(district: FederalDistrict) -> tuple:
+    return (
+        district.name,
+        district.population,
+        [
+            (
+                region.id,
+                region.name,
+                region.population,
+                region.federal_district,
+                [_encode_settlement(city) for city in region.cities],
+                [
+                    (
+                        urban_district.name,
+                        urban_district.population,
+                        [_encode_settlement(settlement) for settlement in urban_district.settlements],
+                    )
+                    for urban_district in region.urban_districts
+                ],
+            )
+            for region in district.regions
+        ],
+    )
+
+
+def _decode_settlements(rows) -> List[Settlement]:
+    types = _SETTLEMENT_TYPES
+    return [Settlement(intern(name), types[type_value], population, settlement_id)
+            for name, type_value, population, settlement_id in rows]
+
+
+def _decode_district(row) -> FederalDistrict:
+    name, population, regions = row
+    return FederalDistrict(
+        name=intern(name),
+        population=population,
+        regions=[
+            Region(
+                id=intern(region_id),
+                name=intern(region_name),
+                population=region_population,
+                federal_district=intern(federal_district),
+                cities=_decode_settlements(cities),
+                urban_districts=[
+                    UrbanDistrict(
+                        name=intern(district_name),
+                        population=district_population,
+                        settlements=_decode_settlements(settlements),
+                    )
+                    for district_name, district_population, settlements in urban_districts
+                ],
+            )
+            for region_id, region_name, region_population, federal_district, cities, urban_districts in regions
+        ],
+    )
+
+
+def write_snapshot(path: Path, files: Sequence[Tuple[str, Path]], districts: Sequence[FederalDistrict]) -> int:
+    """
+    Записать снимок
+
+    Args:
+        path: Путь к файлу снимка (перезаписывается атомарно)
+        files: Исходные JSON [(название округа, путь)], для отпечатка и оглавления
+        districts: Загруженные из них федеральные округа (в том же порядке)
+
+    Returns:
+        Размер снимка в байтах
+    """
+    payloads = [marshal.dumps(_encode_district(district)) for district in districts]
+
+    # Смещения зависят от длины заголовка, а заголовок - от смещений:
+    # оглавление пересчитывается, пока длина заголовка не перестанет меняться
+    header_length = 0
+    while True:
+        offset = _PREFIX.size + header_length
+        toc = []
+        for (name, _), payload in zip(files, payloads):
+            toc.append([name, offset, len(payload), zlib.crc32(payload)])
+            offset += len(payload)
+        header = marshal.dumps({
+            "python": _python_tag(),
+            "sources": source_fingerprint(files),
+            "districts": toc,
+        })
+        if len(header) == header_length:
+            break
+        header_length = len(header)
+
+    tmp_path = path.with_name(path.name + ".tmp")
+    with open(tmp_path, "wb") as f:
+        f.write(_PREFIX.pack(SNAPSHOT_MAGIC, SNAPSHOT_FORMAT_VERSION, len(header), zlib.crc32(header)))
+        f.write(header)
+        for payload in payloads:
+            f.write(payload)
+    os.replace(tmp_path, path)
+    return path.stat().st_size
+
+
+def _read_header(buffer) -> Dict[str, Any]:
+    if len(buffer) < _PREFIX.size:
+        raise SnapshotError("файл короче заголовка")
+    magic, version, header_length, header_crc = _PREFIX.unpack_from(buffer, 0)
+    if magic != SNAPSHOT_MAGIC:
+        raise SnapshotError("не файл снимка")
+    if version != SNAPSHOT_FORMAT_VERSION:
+        raise SnapshotError(f"версия формата {version}, ожидается {SNAPSHOT_FORMAT_VERSION}")
+    header_bytes = buffer[_PREFIX.size:_PREFIX.size + header_length]
+    if len(header_bytes) != header_length or zlib.crc32(header_bytes) != header_crc:
+        raise SnapshotError("не сходится контрольная сумма заголовка")
+    header = marshal.loads(header_bytes)
+    if header["python"] != _python_tag():
+        raise SnapshotError(f"собран для {header['python']}, текущий {_python_tag()}")
+    return header
+
+
+def read_snapshot(
+    path: Path,
+    files: Sequence[Tuple[str, Path]],
+    names: Optional[Sequence[str]] = None
+) -> Optional[List[FederalDistrict]]:
+    """
+    Прочитать снимок, если он соответствует исходным JSON
+
+    Args:
+        path: Путь к файлу снимка
+        files: Исходные JSON [(название округа, путь)]
+        names: Читать только эти округа (по умолчанию - все)
+
+    Returns:
+        Федеральные округа в порядке оглавления или None, если снимок
+        отсутствует, не подходит или в нем нет запрошенного округа
+        (причина выводится в лог)
+    """
+    if not path.exists():
+        return None
+    try:
+        with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            header = _read_header(buffer)
+            if header["sources"] != source_fingerprint(files):
+                print(f"[INFO] Снимок {path.name} устарел (исходные JSON изменились), загрузка из JSON")
+                return None
+            toc = header["districts"]
+            if names is not None:
+                missing = set(names) - {name for name, *_ in toc}
+                if missing:
+                    raise SnapshotError(f"нет округов {', '.join(sorted(missing))}")
+                toc = [entry for entry in toc if entry[0] in names]
+            districts = []
+            view = memoryview(buffer)
+            try:
+                for name, offset, length, crc in toc:
+                    payload = view[offset:offset + length]
+                    try:
+                        if len(payload) != length or zlib.crc32(payload) != crc:
+                            raise SnapshotError(f"не сходится контрольная сумма округа {name}")
+                        districts.append(_decode_district(marshal.loads(payload)))
+                    finally:
+                        payload.release()
+            finally:
+                view.release()
+            return districts
+    except (SnapshotError, OSError, ValueError, EOFError, TypeError, KeyError) as e:
+        print(f"[WARNING] Снимок {path.name} не используется: {e}")
+        return None
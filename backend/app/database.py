@@ -2,10 +2,16 @@
 Настройка базы данных
 Поддерживает SQLite (для разработки) и PostgreSQL (для продакшена)
 """
+import asyncio
 import os
-from sqlalchemy import create_engine, Column, String, Integer, Float, DateTime
+import threading
+from urllib.parse import quote
+from sqlalchemy import create_engine, event, Column, String, Integer, Float, DateTime, Index, TypeDecorator
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+from sqlalchemy.util import await_only
 from datetime import datetime, timezone
 
 # База данных - используем переменную окружения или SQLite по умолчанию
@@ -17,43 +23,345 @@ SQLALCHEMY_DATABASE_URL = os.getenv(
     "sqlite:///./data/happy_russia.db"  # Используем папку data для персистентности
 )
 
+# Настройки SQLite (применяются к каждому соединению с файлом БД)
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")  # С WAL NORMAL не теряет целостность
+SQLITE_CACHE_SIZE_KB = int(os.getenv("SQLITE_CACHE_SIZE_KB", "65536"))
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+SQLITE_READ_POOL_SIZE = int(os.getenv("SQLITE_READ_POOL_SIZE", "5"))
+
+
+def _sqlite_file_path(url: str):
+    """Путь к файлу SQLite или None для БД в памяти"""
+    path = url.partition("://")[2][1:].split("?")[0]
+    if not path or path == ":memory:" or path.startswith("file:"):
+        return None
+    return path
+
+
+def _async_database_url(url: str) -> str:
+    """URL асинхронного драйвера для того же DATABASE_URL
+
+    sqlite:///...     -> sqlite+aiosqlite:///...
+    postgresql://...  -> postgresql+asyncpg://...
+    """
+    scheme, sep, rest = url.partition("://")
+    dialect = scheme.split("+")[0]
+    if dialect == "sqlite":
+        return f"sqlite+aiosqlite{sep}{rest}"
+    if dialect in ("postgresql", "postgres"):
+        return f"postgresql+asyncpg{sep}{rest}"
+    return url
+
+
+def _shared_memory_url(url: str) -> str:
+    """URL общей для всех соединений процесса БД SQLite в памяти
+
+    У каждого соединения с :memory: своя пустая БД; именованная БД
+    в общем кэше видна всем соединениям процесса (URI file:... задается как есть)
+    """
+    scheme, _, rest = url.partition("://")
+    if rest[1:].startswith("file:"):
+        return url
+    return f"{scheme}:///file:happy_russia_memory?mode=memory&cache=shared&uri=true"
+
+
+def _read_only_url(url: str) -> str:
+    """URL того же файла SQLite, открываемого только для чтения"""
+    scheme = url.partition("://")[0]
+    path = quote(os.path.abspath(_sqlite_file_path(url)))
+    return f"{scheme}:///file:{path}?mode=ro&uri=true"
+
+
+def _sqlite_pragmas(read_only: bool):
+    """Обработчик connect, настраивающий соединение SQLite"""
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        if not read_only:
+            # WAL: читатели не блокируют писателя и наоборот (режим хранится в файле БД)
+            cursor.execute("PRAGMA journal_mode=WAL")
+            cursor.execute(f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}")
+        else:
+            cursor.execute("PRAGMA query_only=ON")
+        cursor.execute(f"PRAGMA cache_size=-{SQLITE_CACHE_SIZE_KB}")
+        cursor.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+        cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+        cursor.execute("PRAGMA temp_store=MEMORY")
+        cursor.close()
+    return set_pragmas
+
+
+class SQLiteWriterLock:
+    """
+    Один писатель в файл SQLite на процесс
+
+    Синхронный и асинхронный engine открывают по своему соединению-писателю.
+    Блокировка берется при выдаче соединения-писателя любого из них и
+    отпускается при его возврате в пул, поэтому транзакции записи идут по
+    очереди и не упираются в busy_timeout ("database is locked").
+
+    Синхронные писатели (фоновые потоки) ждут блокировку в своем потоке,
+    асинхронные - не блокируя цикл событий (выдача соединения асинхронного
+    engine выполняется в greenlet, откуда можно дождаться корутины).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+
+    async def _acquire_async(self):
+        if self._lock.acquire(blocking=False):
+            return
+        acquiring = asyncio.ensure_future(asyncio.to_thread(self._lock.acquire))
+        try:
+            await asyncio.shield(acquiring)
+        except asyncio.CancelledError:
+            # Ожидание отменено: блокировку, взятую после отмены, отпускаем
+            acquiring.add_done_callback(lambda _: self._lock.release())
+            raise
+
+    def _on_sync_checkout(self, dbapi_connection, connection_record, connection_proxy):
+        self._lock.acquire()
+        connection_record.info["writer_lock"] = True
+
+    def _on_async_checkout(self, dbapi_connection, connection_record, connection_proxy):
+        await_only(self._acquire_async())
+        connection_record.info["writer_lock"] = True
+
+    def _on_checkin(self, dbapi_connection, connection_record):
+        if connection_record.info.pop("writer_lock", False):
+            self._lock.release()
+
+    def attach(self, sync_writer, async_writer):
+        """Подключить блокировку к пулам соединений-писателей"""
+        event.listen(sync_writer, "checkout", self._on_sync_checkout)
+        event.listen(async_writer.sync_engine, "checkout", self._on_async_checkout)
+        for writer in (sync_writer, async_writer.sync_engine):
+            event.listen(writer, "checkin", self._on_checkin)
+
+
+# Асинхронный engine для обработчиков запросов (asyncpg / aiosqlite).
+# Синхронный engine остается для инициализации, миграций и фоновых задач.
+# asyncpg не понимает параметр sslmode - при необходимости задайте
+# ASYNC_DATABASE_URL явно (например, с ?ssl=verify-full)
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL") or _async_database_url(SQLALCHEMY_DATABASE_URL)
+
 # Настройка engine в зависимости от типа БД
-if SQLALCHEMY_DATABASE_URL.startswith("sqlite"):
-    # Для SQLite нужны специальные параметры
+if SQLALCHEMY_DATABASE_URL.startswith("sqlite") and _sqlite_file_path(SQLALCHEMY_DATABASE_URL):
+    # SQLite в файле: WAL, один писатель (соединения-писатели синхронного и
+    # асинхронного engine выдаются по очереди под общей блокировкой, записи
+    # не получают "database is locked") и пул только для чтения для рейтингов
+    writer_options = {"pool_size": 1, "max_overflow": 0}
+    reader_options = {"pool_size": SQLITE_READ_POOL_SIZE, "max_overflow": 0}
     engine = create_engine(
-        SQLALCHEMY_DATABASE_URL, 
-        connect_args={"check_same_thread": False}
+        SQLALCHEMY_DATABASE_URL,
+        connect_args={"check_same_thread": False},
+        **writer_options
+    )
+    read_engine = create_engine(
+        _read_only_url(SQLALCHEMY_DATABASE_URL),
+        connect_args={"check_same_thread": False},
+        **reader_options
+    )
+    async_engine = create_async_engine(ASYNC_DATABASE_URL, **writer_options)
+    async_read_engine = create_async_engine(_read_only_url(ASYNC_DATABASE_URL), **reader_options)
+    for writer in (engine, async_engine.sync_engine):
+        event.listen(writer, "connect", _sqlite_pragmas(read_only=False))
+    for reader in (read_engine, async_read_engine.sync_engine):
+        event.listen(reader, "connect", _sqlite_pragmas(read_only=True))
+    sqlite_writer_lock = SQLiteWriterLock()
+    sqlite_writer_lock.attach(engine, async_engine)
+elif SQLALCHEMY_DATABASE_URL.startswith("sqlite"):
+    # SQLite в памяти (тесты): синхронный и асинхронный engine открывают одну
+    # БД в общем кэше; StaticPool держит соединение, а с ним и БД, до конца процесса
+    memory_url = _shared_memory_url(SQLALCHEMY_DATABASE_URL)
+    engine = read_engine = create_engine(
+        memory_url,
+        connect_args={"check_same_thread": False},
+        poolclass=StaticPool
+    )
+    async_engine = async_read_engine = create_async_engine(
+        os.getenv("ASYNC_DATABASE_URL") or _async_database_url(memory_url),
+        poolclass=StaticPool
     )
 else:
     # Для PostgreSQL и других БД
     # Используем pool_pre_ping для проверки соединения перед использованием
-    engine = create_engine(
+    engine = read_engine = create_engine(
         SQLALCHEMY_DATABASE_URL,
         pool_pre_ping=True,  # Проверка соединения перед использованием
         pool_size=5,  # Размер пула соединений
         max_overflow=10  # Максимальное количество дополнительных соединений
     )
+    async_engine = async_read_engine = create_async_engine(
+        ASYNC_DATABASE_URL,
+        pool_pre_ping=True,
+        pool_size=5,
+        max_overflow=10
+    )
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# Сессии только для чтения (рейтинги); для PostgreSQL - тот же engine
+ReadSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=read_engine)
+
+# expire_on_commit=False: после commit атрибуты объектов читаются без
+# неявного (синхронного) обращения к БД
+AsyncSessionLocal = async_sessionmaker(
+    async_engine,
+    class_=AsyncSession,
+    autoflush=False,
+    expire_on_commit=False
+)
+AsyncReadSessionLocal = async_sessionmaker(
+    async_read_engine,
+    class_=AsyncSession,
+    autoflush=False,
+    expire_on_commit=False
+)
 
 Base = declarative_base()
 
 
+def to_utc_naive(value: datetime) -> datetime:
+    """Дата в UTC без часового пояса (naive-даты считаются уже заданными в UTC)"""
+    if value.tzinfo is not None:
+        return value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+class NaiveDateTime(TypeDecorator):
+    """DateTime без часового пояса, в UTC
+
+    Даты хранятся в колонках без часового пояса. Aware-даты (от клиентов
+    со смещением, datetime.now(timezone.utc)) переводятся в UTC и
+    передаются без tzinfo: asyncpg отклоняет aware-даты для таких колонок,
+    а psycopg2 передает их как timestamptz, и PostgreSQL пересчитывает их
+    в часовой пояс сессии
+    """
+    impl = DateTime
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if value is not None:
+            return to_utc_naive(value)
+        return value
+
+
 class CheckInDB(Base):
     """Модель чек-ина в базе данных"""
     __tablename__ = "checkins"
 
     id = Column(String, primary_key=True, index=True)
-    region_id = Column(String, index=True, nullable=False)
-    region_name = Column(String, nullable=False)
+    region_id = Column(String, nullable=False)
     mood = Column(Integer, nullable=False)  # 1-5
-    date = Column(DateTime, nullable=False, index=True)
-    user_id = Column(String, nullable=True, index=True)
-    city_id = Column(String, index=True, nullable=True)
-    city_name = Column(String, nullable=True)
-    federal_district = Column(String, nullable=True)
-    district = Column(String, nullable=True)
-    created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
+    date = Column(NaiveDateTime, nullable=False)
+    user_id = Column(String, nullable=True)
+    city_id = Column(String, nullable=True)
+    # Названия хранятся ключами словаря name_dictionary (app/services/name_dictionary.py);
+    # пустые названия города, округа и района - NULL
+    region_name_id = Column(Integer, nullable=False)
+    city_name_id = Column(Integer, nullable=True)
+    federal_district_id = Column(Integer, nullable=True)
+    district_id = Column(Integer, nullable=True)
+    created_at = Column(NaiveDateTime, default=lambda: datetime.now(timezone.utc))
+
+    # Составные индексы под запросы статистики (новые индексы в существующих
+    # базах создаются миграциями, см. app/migrations.py)
+    __table_args__ = (
+        # Рейтинг районов города: WHERE city_id = ? AND date >= ? ... PARTITION BY district_id
+        Index("ix_checkins_city_district_date", "city_id", "district_id", "date"),
+        # Статистика региона: WHERE region_id = ? AND date >= ?, покрывает user_id и mood
+        Index("ix_checkins_region_date_user_mood", "region_id", "date", "user_id", "mood"),
+        # Выборки за период по всем регионам: WHERE date >= ?, покрывает region_id, user_id и mood
+        Index("ix_checkins_date_region_user_mood", "date", "region_id", "user_id", "mood"),
+        # Последний чек-ин пользователя: WHERE user_id = ? ... ORDER BY date DESC
+        Index("ix_checkins_user_date", "user_id", "date"),
+    )
+
+
+class NameDB(Base):
+    """Словарь названий регионов, городов, федеральных округов и районов
+
+    Чек-ины ссылаются на названия целочисленными ключами
+    """
+    __tablename__ = "name_dictionary"
+
+    id = Column(Integer, primary_key=True)
+    value = Column(String, nullable=False, unique=True)
+
+
+class LatestMoodDB(Base):
+    """Последнее настроение пользователя в регионе, городе и федеральном округе
+
+    Производная таблица: обновляется при записи чек-инов
+    (app/services/latest_moods.py), рейтинги считаются по ней
+    """
+    __tablename__ = "latest_moods"
+
+    level = Column(String, primary_key=True)  # region / city / federal_district
+    area_id = Column(String, primary_key=True)  # ID региона, ключ города или название округа
+    user_id = Column(String, primary_key=True)
+    area_name = Column(String, nullable=False)
+    region_id = Column(String, nullable=True)  # Регион города (для рейтинга городов региона)
+    checkin_id = Column(String, nullable=False, index=True)  # Чек-ин, из которого взято настроение
+    mood = Column(Integer, nullable=False)
+    date = Column(NaiveDateTime, nullable=False)
+
+    __table_args__ = (
+        # Неполный первый час периода: WHERE date >= ? AND date < ?
+        Index("ix_latest_moods_date", "date"),
+    )
+
+
+class MoodBucketDB(Base):
+    """Почасовая гистограмма настроений по областям
+
+    В ячейку (область, час) попадает пользователь, чей последний чек-ин
+    в области (latest_moods) сделан в этот час. Рейтинг за день/неделю/месяц
+    собирается из не более чем 720 ячеек на область.
+    """
+    __tablename__ = "mood_buckets"
+
+    # Первичный ключ начинается с hour: выборка за период - поиск по диапазону ключа
+    hour = Column(NaiveDateTime, primary_key=True)  # Начало часа
+    level = Column(String, primary_key=True)  # region / city / federal_district
+    area_id = Column(String, primary_key=True)
+    area_name = Column(String, nullable=False)
+    region_id = Column(String, nullable=True)
+    mood_1 = Column(Integer, nullable=False, default=0)
+    mood_2 = Column(Integer, nullable=False, default=0)
+    mood_3 = Column(Integer, nullable=False, default=0)
+    mood_4 = Column(Integer, nullable=False, default=0)
+    mood_5 = Column(Integer, nullable=False, default=0)
+
+
+class CheckInDailyStatsDB(Base):
+    """Дневная сводка настроений по областям для свернутых старых чек-инов
+
+    Строится задачей сворачивания (app/services/compaction.py): пользователь
+    учитывается один раз за день со своим последним чек-ином дня в области
+    """
+    __tablename__ = "checkin_daily_stats"
+
+    day = Column(NaiveDateTime, primary_key=True)  # Начало дня
+    level = Column(String, primary_key=True)  # region / city / federal_district
+    area_id = Column(String, primary_key=True)
+    area_name = Column(String, nullable=False)
+    region_id = Column(String, nullable=True)
+    mood_1 = Column(Integer, nullable=False, default=0)
+    mood_2 = Column(Integer, nullable=False, default=0)
+    mood_3 = Column(Integer, nullable=False, default=0)
+    mood_4 = Column(Integer, nullable=False, default=0)
+    mood_5 = Column(Integer, nullable=False, default=0)
+    unique_users = Column(Integer, nullable=False, default=0)
+
+
+class CheckInCompactionDB(Base):
+    """Свернутые дни: чек-ины дня, созданные не позже compacted_at, уже учтены в сводке"""
+    __tablename__ = "checkin_compactions"
+
+    day = Column(NaiveDateTime, primary_key=True)
+    compacted_at = Column(NaiveDateTime, nullable=False)
+    raw_rows = Column(Integer, nullable=False, default=0)  # Сколько чек-инов свернуто
 
 
 class UserDB(Base):
@@ -67,7 +375,7 @@ class UserDB(Base):
     registration_region_id = Column(String, nullable=True)
     registration_region_name = Column(String, nullable=True)
     registration_federal_district = Column(String, nullable=True)
-    created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
+    created_at = Column(NaiveDateTime, default=lambda: datetime.now(timezone.utc))
 
 
 # Создать таблицы
@@ -80,6 +388,11 @@ def init_db():
             os.makedirs(os.path.dirname(db_path), exist_ok=True)
     
     Base.metadata.create_all(bind=engine)
+    
+    # create_all не меняет уже существующие таблицы - изменения схемы
+    # (например, новые индексы) применяются миграциями
+    from app.migrations import run_migrations
+    run_migrations(engine)
 
 
 # Dependency для получения сессии БД
@@ -91,3 +404,20 @@ def get_db():
     finally:
         db.close()
 
+
+async def get_async_db():
+    """Получить асинхронную сессию базы данных
+
+    Синхронные сервисы (статистика, запись чек-инов) вызываются через
+    await db.run_sync(функция, ...) - их запросы выполняются асинхронным
+    драйвером и не блокируют event loop
+    """
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
+async def get_async_read_db():
+    """Получить асинхронную сессию только для чтения (рейтинги и статистика)"""
+    async with AsyncReadSessionLocal() as db:
+        yield db
+
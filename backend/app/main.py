@@ -1,11 +1,20 @@
 """
 Главный файл FastAPI приложения
 """
+import asyncio
 from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from app.database import init_db
+from app.database import init_db, engine, SessionLocal, async_engine, async_read_engine
 from app.routers import checkins, rankings, users
+from app.services.latest_moods import init_latest_moods
+from app.services.ranking_snapshots import ranking_snapshots
+from app.services.ingest_buffer import ingest_buffer
+from app.services.id_filter import checkin_id_filter
+from app.services.name_dictionary import name_dictionary
+from app.services.maintenance import maintenance
+from app.services.partitions import run_partition_maintenance
+from app.data.russia_settlements import SETTLEMENTS_PRELOAD, preload_russia_data, russia_data_stats
 
 
 # Инициализация базы данных при старте
@@ -13,8 +22,25 @@ from app.routers import checkins, rankings, users
 async def lifespan(app: FastAPI):
     # Startup
     init_db()
+    # Секции checkins должны существовать до первой записи
+    run_partition_maintenance(engine)
+    with SessionLocal() as db:
+        name_dictionary.load(db)
+        init_latest_moods(db)
+        checkin_id_filter.seed(db)
+    # Справочник населенных пунктов - в отдельном потоке, не блокируя цикл событий
+    if SETTLEMENTS_PRELOAD:
+        await asyncio.to_thread(preload_russia_data)
+    await ingest_buffer.start()
+    await ranking_snapshots.start()
+    await maintenance.start()
     yield
-    # Shutdown (если нужно)
+    # Shutdown: сначала дописываем очередь чек-инов
+    await ingest_buffer.stop()
+    await ranking_snapshots.stop()
+    await maintenance.stop()
+    await async_engine.dispose()
+    await async_read_engine.dispose()
 
 
 # Создаем приложение
@@ -55,5 +81,11 @@ async def root():
 @app.get("/api/health")
 async def health_check():
     """Проверка здоровья API"""
-    return {"status": "ok"}
+    return {
+        "status": "ok",
+        "rankingSnapshotAge": ranking_snapshots.ages(),
+        "checkInIngest": ingest_buffer.stats(),
+        "checkInIdFilter": checkin_id_filter.stats(),
+        "settlementsData": russia_data_stats()
+    }
 
@@ -0,0 +1,141 @@
+"""
+Миграции схемы базы данных
+
+Base.metadata.create_all создает только отсутствующие таблицы и не меняет
+существующие (не добавляет колонки и индексы). Изменения схемы для уже
+развернутых баз описываются здесь упорядоченным списком шагов; номера
+примененных шагов хранятся в таблице schema_migrations.
+
+Каждый шаг должен быть идемпотентным: на новой базе create_all уже создал
+актуальную схему, и шаг не должен ничего ломать.
+"""
+from datetime import datetime, timezone
+from typing import Callable, List, Tuple
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Connection, Engine
+
+
+def _create_district_ranking_index(conn: Connection):
+    """Индекс рейтинга районов города"""
+    # В актуальной схеме (district_id) индекс уже создан create_all
+    if "district" not in {column["name"] for column in inspect(conn).get_columns("checkins")}:
+        return
+    conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_checkins_city_district_date "
+        "ON checkins (city_id, district, date)"
+    ))
+
+
+def _create_covering_indexes(conn: Connection):
+    """Составные покрывающие индексы вместо одноколоночных"""
+    conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_checkins_region_date_user_mood "
+        "ON checkins (region_id, date, user_id, mood)"
+    ))
+    conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_checkins_date_region_user_mood "
+        "ON checkins (date, region_id, user_id, mood)"
+    ))
+    conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_checkins_user_date "
+        "ON checkins (user_id, date)"
+    ))
+    # Одноколоночные индексы стали префиксами составных и только замедляют запись
+    for index_name in (
+        "ix_checkins_region_id",
+        "ix_checkins_date",
+        "ix_checkins_user_id",
+        "ix_checkins_city_id",
+    ):
+        conn.execute(text(f"DROP INDEX IF EXISTS {index_name}"))
+    # Граница периода в рейтингах фильтруется только по date, без level
+    conn.execute(text("DROP INDEX IF EXISTS ix_latest_moods_level_date"))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_latest_moods_date ON latest_moods (date)"))
+
+
+def _recreate_mood_buckets(conn: Connection):
+    """Первичный ключ mood_buckets (hour, level, area_id) вместо (level, area_id, hour)
+
+    Таблица производная: пересоздается пустой и заполняется заново
+    при старте (init_latest_moods)
+    """
+    from app.database import MoodBucketDB
+    MoodBucketDB.__table__.drop(conn, checkfirst=True)
+    MoodBucketDB.__table__.create(conn)
+
+
+def _encode_checkin_names(conn: Connection):
+    """Названия в checkins - ключами словаря name_dictionary вместо строк
+
+    Пустые необязательные названия (city_name, federal_district, district)
+    становятся NULL. На новой базе (колонки region_name нет) ничего не делает.
+    """
+    columns = {column["name"] for column in inspect(conn).get_columns("checkins")}
+    if "region_name" not in columns:
+        return
+    for column in ("region_name_id", "city_name_id", "federal_district_id", "district_id"):
+        if column not in columns:
+            conn.execute(text(f"ALTER TABLE checkins ADD COLUMN {column} INTEGER"))
+
+    # region_name обязателен и сохраняется как есть (в том числе пустым)
+    conn.execute(text(
+        "INSERT INTO name_dictionary (value) "
+        "SELECT DISTINCT region_name FROM checkins WHERE region_name IS NOT NULL "
+        "ON CONFLICT (value) DO NOTHING"
+    ))
+    for column in ("city_name", "federal_district", "district"):
+        conn.execute(text(
+            f"INSERT INTO name_dictionary (value) "
+            f"SELECT DISTINCT {column} FROM checkins WHERE {column} IS NOT NULL AND {column} != '' "
+            f"ON CONFLICT (value) DO NOTHING"
+        ))
+    conn.execute(text(
+        "UPDATE checkins SET "
+        "region_name_id = (SELECT id FROM name_dictionary WHERE value = checkins.region_name), "
+        "city_name_id = (SELECT id FROM name_dictionary WHERE value = NULLIF(checkins.city_name, '')), "
+        "federal_district_id = (SELECT id FROM name_dictionary WHERE value = NULLIF(checkins.federal_district, '')), "
+        "district_id = (SELECT id FROM name_dictionary WHERE value = NULLIF(checkins.district, ''))"
+    ))
+
+    # Индекс рейтинга районов ссылается на удаляемую колонку district
+    conn.execute(text("DROP INDEX IF EXISTS ix_checkins_city_district_date"))
+    conn.execute(text(
+        "CREATE INDEX ix_checkins_city_district_date ON checkins (city_id, district_id, date)"
+    ))
+    for column in ("region_name", "city_name", "federal_district", "district"):
+        conn.execute(text(f"ALTER TABLE checkins DROP COLUMN {column}"))
+    if conn.dialect.name == "postgresql":
+        conn.execute(text("ALTER TABLE checkins ALTER COLUMN region_name_id SET NOT NULL"))
+
+
+# (номер, описание, функция) - номера только растут, примененные шаги не меняются
+MIGRATIONS: List[Tuple[int, str, Callable[[Connection], None]]] = [
+    (1, "Индекс рейтинга районов (city_id, district, date)", _create_district_ranking_index),
+    (2, "Покрывающие индексы для статистики", _create_covering_indexes),
+    (3, "Первичный ключ mood_buckets по часу", _recreate_mood_buckets),
+    (4, "Словарь названий для checkins", _encode_checkin_names),
+]
+
+
+def run_migrations(engine: Engine):
+    """Применить еще не примененные миграции (вызывается из init_db)"""
+    with engine.begin() as conn:
+        conn.execute(text(
+            "CREATE TABLE IF NOT EXISTS schema_migrations ("
+            "version INTEGER PRIMARY KEY, "
+            "name VARCHAR NOT NULL, "
+            "applied_at TIMESTAMP NOT NULL)"
+        ))
+        applied = {row[0] for row in conn.execute(text("SELECT version FROM schema_migrations"))}
+
+    for version, name, migrate in MIGRATIONS:
+        if version in applied:
+            continue
+        # Каждая миграция - в своей транзакции вместе с отметкой о применении
+        with engine.begin() as conn:
+            migrate(conn)
+            conn.execute(
+                text("INSERT INTO schema_migrations (version, name, applied_at) VALUES (:version, :name, :applied_at)"),
+                {"version": version, "name": name, "applied_at": datetime.now(timezone.utc)}
+            )
+        print(f"[INFO] Применена миграция {version}: {name}")
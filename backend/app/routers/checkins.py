@@ -2,11 +2,25 @@
 Роутер для работы с чек-инами
 """
 from typing import List
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
-from app.database import get_db
+from fastapi import APIRouter, Depends, HTTPException, Request
+from pydantic import ValidationError
+from sqlalchemy import delete
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.database import get_async_db
 from app.models.schemas import CheckInCreate, CheckInResponse
-from app.database import CheckInDB
+from app.database import CheckInDB, LatestMoodDB, MoodBucketDB, CheckInDailyStatsDB, CheckInCompactionDB
+from app.services.ranking_cache import ranking_cache
+from app.services.checkin_writer import (
+    upsert_checkins,
+    CHECKIN_CHUNK_SIZE,
+    STATUS_INSERTED,
+    STATUS_UPDATED,
+    STATUS_SKIPPED,
+    STATUS_DUPLICATE
+)
+from app.services.ingest_buffer import ingest_buffer, IngestBufferFull
+from app.services.id_filter import checkin_id_filter
+from app.services.ndjson_stream import iter_ndjson_lines, NDJSONError
 from datetime import datetime
 
 router = APIRouter(prefix="/checkins", tags=["checkins"])
@@ -15,7 +29,7 @@ router = APIRouter(prefix="/checkins", tags=["checkins"])
 @router.post("", response_model=CheckInResponse, status_code=201)
 async def create_checkin(
     checkin: CheckInCreate,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Создать новый чек-ин
@@ -27,125 +41,151 @@ async def create_checkin(
             status_code=400,
             detail="userId (номер телефона) является обязательным полем"
         )
-    # Проверяем, не существует ли уже чек-ин с таким ID
-    existing = db.query(CheckInDB).filter(CheckInDB.id == checkin.id).first()
-    if existing:
-        # Если существует, обновляем его
-        existing.region_id = checkin.region_id
-        existing.region_name = checkin.region_name
-        existing.mood = checkin.mood
-        existing.date = checkin.date
-        existing.user_id = checkin.user_id
-        existing.city_id = checkin.city_id
-        existing.city_name = checkin.city_name
-        existing.federal_district = checkin.federal_district
-        existing.district = checkin.district
-        db.commit()
-        db.refresh(existing)
-        return CheckInResponse(
-            id=existing.id,
-            regionId=existing.region_id,
-            regionName=existing.region_name,
-            mood=existing.mood,
-            date=existing.date,
-            userId=existing.user_id,
-            cityId=existing.city_id,
-            cityName=existing.city_name,
-            federalDistrict=existing.federal_district,
-            district=existing.district
-        )
     
-    # Создаем новый чек-ин
-    db_checkin = CheckInDB(
+    # Буферизованный режим: чек-ин записывается фоновой задачей пакетом
+    if ingest_buffer.running:
+        try:
+            await ingest_buffer.submit(checkin)
+        except IngestBufferFull:
+            raise HTTPException(status_code=503, detail="Очередь чек-инов переполнена, повторите позже")
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Ошибка при сохранении чек-ина: {str(e)}")
+    else:
+        # Создаем новый чек-ин или обновляем существующий с таким ID
+        # (названия записываются ключами словаря названий)
+        await db.run_sync(upsert_checkins, [checkin])
+        await db.commit()
+        ranking_cache.invalidate()
+
+    return CheckInResponse(
         id=checkin.id,
-        region_id=checkin.region_id,
-        region_name=checkin.region_name,
+        regionId=checkin.region_id,
+        regionName=checkin.region_name,
         mood=checkin.mood,
         date=checkin.date,
-        user_id=checkin.user_id,
-        city_id=checkin.city_id,
-        city_name=checkin.city_name,
-        federal_district=checkin.federal_district,
+        userId=checkin.user_id,
+        cityId=checkin.city_id,
+        cityName=checkin.city_name,
+        federalDistrict=checkin.federal_district,
         district=checkin.district
     )
-    
-    db.add(db_checkin)
-    db.commit()
-    db.refresh(db_checkin)
-    
-    return CheckInResponse(
-        id=db_checkin.id,
-        regionId=db_checkin.region_id,
-        regionName=db_checkin.region_name,
-        mood=db_checkin.mood,
-        date=db_checkin.date,
-        userId=db_checkin.user_id,
-        cityId=db_checkin.city_id,
-        cityName=db_checkin.city_name,
-        federalDistrict=db_checkin.federal_district,
-        district=db_checkin.district
-    )
 
 
 @router.post("/sync", status_code=200)
 async def sync_checkins(
     checkins: List[CheckInCreate],
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Синхронизировать несколько чек-инов
     userId (номер телефона) - обязательное поле для каждого чек-ина
+    
+    В ответе results - статус каждого чек-ина в порядке запроса:
+    inserted / updated / skipped (нет userId) / duplicate (ID повторяется в пакете, записан последний)
     """
-    synced_count = 0
-    for checkin in checkins:
-        # Валидация: userId обязателен
-        if not checkin.user_id or checkin.user_id.strip() == "":
-            continue  # Пропускаем чек-ины без userId
-        
-        existing = db.query(CheckInDB).filter(CheckInDB.id == checkin.id).first()
-        if existing:
-            # Обновляем существующий
-            existing.region_id = checkin.region_id
-            existing.region_name = checkin.region_name
-            existing.mood = checkin.mood
-            existing.date = checkin.date
-            existing.user_id = checkin.user_id
-            existing.city_id = checkin.city_id
-            existing.city_name = checkin.city_name
-            existing.federal_district = checkin.federal_district
-            existing.district = checkin.district
-        else:
-            # Создаем новый
-            db_checkin = CheckInDB(
-                id=checkin.id,
-                region_id=checkin.region_id,
-                region_name=checkin.region_name,
-                mood=checkin.mood,
-                date=checkin.date,
-                user_id=checkin.user_id,
-                city_id=checkin.city_id,
-                city_name=checkin.city_name,
-                federal_district=checkin.federal_district,
-                district=checkin.district
-            )
-            db.add(db_checkin)
-        synced_count += 1
+    # Пакетная запись: один SELECT существующих ID и один upsert на порцию
+    results = await db.run_sync(upsert_checkins, checkins)
+    await db.commit()
+    ranking_cache.invalidate()
+    
+    synced_count = sum(1 for result in results if result["status"] != STATUS_SKIPPED)
+    return {
+        "message": f"Синхронизировано {synced_count} чек-инов",
+        "count": synced_count,
+        "results": results
+    }
+
+
+# Сколько ошибок валидации возвращать в сводке одной порции
+STREAM_SYNC_MAX_ERRORS = 10
+
+
+async def _write_stream_chunk(db: AsyncSession, number: int, chunk: List[CheckInCreate], first_line: int, last_line: int, errors: list) -> dict:
+    """Записать порцию потоковой синхронизации и вернуть ее сводку"""
+    results = await db.run_sync(upsert_checkins, chunk) if chunk else []
+    await db.commit()
+    if chunk:
+        ranking_cache.invalidate()
+    summary = {
+        "chunk": number,
+        "firstLine": first_line,
+        "lastLine": last_line,
+        STATUS_INSERTED: 0,
+        STATUS_UPDATED: 0,
+        STATUS_SKIPPED: 0,
+        STATUS_DUPLICATE: 0,
+        "invalid": len(errors),
+        "errors": errors[:STREAM_SYNC_MAX_ERRORS],
+    }
+    for result in results:
+        summary[result["status"]] += 1
+    return summary
+
+
+@router.post("/sync/stream", status_code=200)
+async def sync_checkins_stream(
+    request: Request,
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    Потоковая синхронизация большого количества чек-инов
+    
+    Тело - NDJSON (один чек-ин в формате POST /api/checkins на строку),
+    при Content-Encoding: gzip - сжатое gzip. Чек-ины проверяются и
+    записываются порциями по мере чтения тела, каждая порция - отдельной
+    транзакцией; строки с ошибками пропускаются.
+    
+    В ответе chunks - сводка по каждой порции: номера строк, количество
+    inserted / updated / skipped / duplicate / invalid и первые ошибки.
+    """
+    gzip = request.headers.get("content-encoding", "").lower() == "gzip"
+    chunks = []
+    chunk: List[CheckInCreate] = []
+    errors = []
+    first_line = None
+    last_line = 0
+    try:
+        async for line_number, line in iter_ndjson_lines(request.stream(), gzip=gzip):
+            if first_line is None:
+                first_line = line_number
+            last_line = line_number
+            try:
+                chunk.append(CheckInCreate.model_validate_json(line))
+            except ValidationError as e:
+                errors.append({"line": line_number, "error": str(e.errors()[0]["msg"])})
+            if len(chunk) + len(errors) >= CHECKIN_CHUNK_SIZE:
+                chunks.append(await _write_stream_chunk(db, len(chunks) + 1, chunk, first_line, last_line, errors))
+                chunk, errors, first_line = [], [], None
+    except NDJSONError as e:
+        raise HTTPException(status_code=400, detail=f"{e} (записано порций: {len(chunks)})")
+    if first_line is not None:
+        chunks.append(await _write_stream_chunk(db, len(chunks) + 1, chunk, first_line, last_line, errors))
     
-    db.commit()
-    return {"message": f"Синхронизировано {synced_count} чек-инов", "count": synced_count}
+    synced_count = sum(summary[STATUS_INSERTED] + summary[STATUS_UPDATED] + summary[STATUS_DUPLICATE] for summary in chunks)
+    return {
+        "message": f"Синхронизировано {synced_count} чек-инов",
+        "count": synced_count,
+        "chunks": chunks
+    }
 
 
 @router.delete("/all", status_code=200)
 async def delete_all_checkins(
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Удалить все чек-ины (только для debug режима)
     """
     try:
-        deleted_count = db.query(CheckInDB).delete()
-        db.commit()
+        deleted_count = (await db.execute(delete(CheckInDB))).rowcount
+        await db.execute(delete(LatestMoodDB))
+        await db.execute(delete(MoodBucketDB))
+        await db.execute(delete(CheckInDailyStatsDB))
+        await db.execute(delete(CheckInCompactionDB))
+        await db.commit()
+        ranking_cache.clear()
+        checkin_id_filter.clear()
         return {"message": f"Удалено {deleted_count} чек-инов", "count": deleted_count}
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=500, detail=f"Ошибка при удалении чек-инов: {str(e)}")
\ No newline at end of file
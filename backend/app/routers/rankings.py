@@ -3,32 +3,52 @@
 """
 from typing import List, Optional
 from fastapi import APIRouter, Depends, Query
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from app.database import get_db
+from app.database import get_async_read_db
 from app.models.schemas import (
     RegionMoodResponse,
     CityMoodResponse,
+    DistrictMoodResponse,
     FederalDistrictMoodResponse
 )
-from app.services.statistics import (
-    calculate_region_ranking,
-    calculate_city_ranking,
-    calculate_federal_district_ranking,
-    calculate_region_stats
-)
+from app.services.statistics import compute_rankings, calculate_region_stats, calculate_district_ranking
+from app.services.ranking_cache import ranking_cache
+from app.services.ranking_snapshots import ranking_snapshots
 
 router = APIRouter(prefix="/regions", tags=["rankings"])
 
 
+def _cached(db: Session, key, compute):
+    """Рейтинг из кэша или расчет в сессии запроса (вызывается через db.run_sync)"""
+    return ranking_cache.get_or_compute(key, compute, db)
+
+
+async def _get_rankings(db: AsyncSession, period: str):
+    """Рейтинги всех уровней за период
+    
+    Берутся из последнего снимка фонового обновления, а пока снимка нет
+    (или обновление выключено) - считаются через кэш.
+    """
+    snapshot = ranking_snapshots.get(period)
+    if snapshot is not None:
+        return snapshot.rankings
+    return await db.run_sync(
+        _cached,
+        ("rankings", period, None),
+        lambda session: compute_rankings(session, period)
+    )
+
+
 @router.get("/ranking", response_model=List[RegionMoodResponse])
 async def get_regions_ranking(
     period: str = Query("day", pattern="^(day|week|month)$"),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_read_db)
 ):
     """
     Получить рейтинг всех регионов
     """
-    rankings = calculate_region_ranking(db, period)
+    rankings = (await _get_rankings(db, period))["regions"]
     return rankings
 
 
@@ -36,12 +56,12 @@ async def get_regions_ranking(
 async def get_region_stats(
     region_id: str,
     period: str = Query("day", pattern="^(day|week|month)$"),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_read_db)
 ):
     """
     Получить статистику конкретного региона
     """
-    stats = calculate_region_stats(db, region_id, period)
+    stats = await db.run_sync(calculate_region_stats, region_id, period)
     if not stats:
         from fastapi import HTTPException
         raise HTTPException(status_code=404, detail="Регион не найден или нет данных")
@@ -52,24 +72,24 @@ async def get_region_stats(
 async def get_cities_ranking(
     region_id: str,
     period: str = Query("day", pattern="^(day|week|month)$"),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_read_db)
 ):
     """
     Получить рейтинг городов в регионе
     """
-    rankings = calculate_city_ranking(db, region_id, period)
+    rankings = (await _get_rankings(db, period))["cities_by_region"].get(region_id, [])
     return rankings
 
 
 @router.get("/federal-districts/ranking", response_model=List[FederalDistrictMoodResponse])
 async def get_federal_districts_ranking(
     period: str = Query("day", pattern="^(day|week|month)$"),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_read_db)
 ):
     """
     Получить рейтинг федеральных округов
     """
-    rankings = calculate_federal_district_ranking(db, period)
+    rankings = (await _get_rankings(db, period))["federal_districts"]
     return rankings
 
 
@@ -80,27 +100,28 @@ cities_router = APIRouter(prefix="/cities", tags=["rankings"])
 @cities_router.get("/ranking", response_model=List[CityMoodResponse])
 async def get_all_cities_ranking(
     period: str = Query("day", pattern="^(day|week|month)$"),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_read_db)
 ):
     """
     Получить рейтинг всех городов России
     """
-    rankings = calculate_city_ranking(db, None, period)
+    rankings = (await _get_rankings(db, period))["cities"]
     return rankings
 
 
 # Роутер для районов (используем тот же cities_router)
-@cities_router.get("/{city_id}/districts/ranking")
+@cities_router.get("/{city_id}/districts/ranking", response_model=List[DistrictMoodResponse])
 async def get_districts_ranking(
     city_id: str,
     period: str = Query("day", pattern="^(day|week|month)$"),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_read_db)
 ):
     """
     Получить рейтинг районов города
-    TODO: Реализовать когда будет достаточно данных
     """
-    # Пока возвращаем пустой список
-    # В будущем можно группировать по district для конкретного city_id
-    return []
-
+    rankings = await db.run_sync(
+        _cached,
+        ("districts", period, city_id),
+        lambda session: calculate_district_ranking(session, city_id, period)
+    )
+    return rankings
@@ -2,8 +2,8 @@
 Роутер для работы с пользователями
 """
 from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
-from app.database import get_db, UserDB
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.database import get_async_db, UserDB
 from app.models.schemas import UserCreate, UserResponse
 from datetime import datetime, timezone
 
@@ -13,13 +13,13 @@ router = APIRouter(prefix="/users", tags=["users"])
 @router.post("", response_model=UserResponse, status_code=201)
 async def create_user(
     user: UserCreate,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Создать или обновить пользователя (регистрация)
     """
     # Проверяем, существует ли уже пользователь с таким user_id
-    existing = db.query(UserDB).filter(UserDB.user_id == user.user_id).first()
+    existing = await db.get(UserDB, user.user_id)
     
     if existing:
         # Обновляем существующего пользователя
@@ -29,8 +29,8 @@ async def create_user(
         existing.registration_region_id = user.registration_region_id
         existing.registration_region_name = user.registration_region_name
         existing.registration_federal_district = user.registration_federal_district
-        db.commit()
-        db.refresh(existing)
+        await db.commit()
+        await db.refresh(existing)
         return UserResponse(
             user_id=existing.user_id,
             name=existing.name,
@@ -55,8 +55,8 @@ async def create_user(
     )
     
     db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
+    await db.commit()
+    await db.refresh(db_user)
     
     return UserResponse(
         user_id=db_user.user_id,
@@ -73,12 +73,12 @@ async def create_user(
 @router.get("/{user_id}", response_model=UserResponse)
 async def get_user(
     user_id: str,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Получить информацию о пользователе по user_id
     """
-    user = db.query(UserDB).filter(UserDB.user_id == user_id).first()
+    user = await db.get(UserDB, user_id)
     if not user:
         raise HTTPException(status_code=404, detail="Пользователь не найден")
     
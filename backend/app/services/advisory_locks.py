@@ -0,0 +1,34 @@
+"""
+Транзакционные advisory-блокировки PostgreSQL
+
+Сериализуют параллельные транзакции, которые читают и затем меняют
+данные одних и тех же ключей (пользователь, ID чек-ина): блокировка
+держится до commit/rollback. Ключи блокируются в отсортированном порядке,
+поэтому транзакции с пересекающимися наборами ключей не блокируют друг
+друга взаимно.
+
+В SQLite транзакции записи процесса и так идут по очереди (общая
+блокировка писателей, app/database.py), advisory-блокировки не нужны.
+"""
+from typing import Iterable
+from sqlalchemy import String, bindparam, text
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.orm import Session
+
+# Пространства ключей (первый аргумент pg_advisory_xact_lock)
+LOCK_USER = 1
+LOCK_CHECKIN_ID = 2
+
+_LOCK_STATEMENT = text(
+    "SELECT pg_advisory_xact_lock(:namespace, hashtext(key)) FROM unnest(:keys) AS key"
+).bindparams(bindparam("keys", type_=postgresql.ARRAY(String)))
+
+
+def lock_keys(db: Session, namespace: int, keys: Iterable[str]):
+    """Заблокировать ключи до конца транзакции db (только PostgreSQL)"""
+    if db.get_bind().dialect.name != "postgresql":
+        return
+    keys = sorted(set(keys))
+    if keys:
+        # unnest возвращает элементы в порядке массива - блокировки берутся по порядку
+        db.execute(_LOCK_STATEMENT, {"namespace": namespace, "keys": keys})
@@ -0,0 +1,148 @@
+"""
+Пакетная запись чек-инов
+
+Вместо SELECT + INSERT/UPDATE на каждый чек-ин пакет пишется порциями:
+один SELECT существующих ID на порцию и INSERT ... ON CONFLICT (id) DO UPDATE
+через executemany (PostgreSQL и SQLite). ID, которых по фильтру Блума точно
+нет в БД (app/services/id_filter.py), в SELECT не попадают.
+
+Секционированная checkins (app/services/partitions.py) не имеет
+уникального ключа по id: существующие чек-ины порции удаляются и
+вставляются заново (в том числе в секцию другого месяца при смене date).
+Уникальность id держится только на этой проверке, поэтому для
+секционированной таблицы фильтр Блума не используется.
+
+В PostgreSQL ID пакета блокируются advisory-блокировками до commit
+(app/services/advisory_locks.py): параллельная запись того же ID ждет,
+пока первая транзакция не завершится, и видит ее чек-ин при проверке.
+"""
+from typing import Dict, List
+from sqlalchemy import delete, insert
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+from app.database import CheckInDB
+from app.models.schemas import CheckInCreate
+from app.services.advisory_locks import LOCK_CHECKIN_ID, lock_keys
+from app.services.latest_moods import record_checkins
+from app.services.id_filter import checkin_id_filter
+from app.services.partitions import checkins_partitioned
+from app.services.name_dictionary import name_dictionary
+
+# Количество чек-инов в одной порции
+CHECKIN_CHUNK_SIZE = 500
+
+# Статусы чек-инов в ответе синхронизации
+STATUS_INSERTED = "inserted"
+STATUS_UPDATED = "updated"
+STATUS_SKIPPED = "skipped"  # Нет userId
+STATUS_DUPLICATE = "duplicate"  # Тот же ID встречается в пакете позже - записан последний
+
+# Колонки, которые перезаписываются при повторной отправке чек-ина
+UPDATE_COLUMNS = (
+    "region_id",
+    "mood",
+    "date",
+    "user_id",
+    "city_id",
+    "region_name_id",
+    "city_name_id",
+    "federal_district_id",
+    "district_id",
+)
+
+
+def _checkin_names(checkin: CheckInCreate) -> list:
+    """Названия чек-ина (пустые названия города, округа и района не хранятся)"""
+    return [checkin.region_name, checkin.city_name or None, checkin.federal_district or None, checkin.district or None]
+
+
+def _checkin_row(checkin: CheckInCreate, name_ids: Dict[str, int]) -> dict:
+    region_name, city_name, federal_district, district = _checkin_names(checkin)
+    return {
+        "id": checkin.id,
+        "region_id": checkin.region_id,
+        "mood": checkin.mood,
+        "date": checkin.date,
+        "user_id": checkin.user_id,
+        "city_id": checkin.city_id,
+        "region_name_id": name_ids[region_name],
+        "city_name_id": name_ids.get(city_name),
+        "federal_district_id": name_ids.get(federal_district),
+        "district_id": name_ids.get(district),
+    }
+
+
+def _upsert_statement(db: Session):
+    """INSERT ... ON CONFLICT (id) DO UPDATE для текущей БД"""
+    if db.get_bind().dialect.name == "postgresql":
+        stmt = postgresql.insert(CheckInDB)
+    else:
+        stmt = sqlite.insert(CheckInDB)
+    return stmt.on_conflict_do_update(
+        index_elements=["id"],
+        set_={column: getattr(stmt.excluded, column) for column in UPDATE_COLUMNS}
+    )
+
+
+def upsert_checkins(db: Session, checkins: List[CheckInCreate]) -> List[Dict[str, str]]:
+    """
+    Записать пакет чек-инов (без commit)
+
+    Args:
+        db: Сессия базы данных
+        checkins: Чек-ины в порядке получения от клиента
+
+    Returns:
+        Результат по каждому чек-ину в том же порядке: [{"id": ..., "status": ...}]
+    """
+    statuses = [None] * len(checkins)
+
+    # Повторяющиеся ID внутри пакета: записывается последний вариант
+    last_index = {}  # {id: индекс последнего вхождения}
+    for index, checkin in enumerate(checkins):
+        if not checkin.user_id or checkin.user_id.strip() == "":
+            statuses[index] = STATUS_SKIPPED  # Пропускаем чек-ины без userId
+            continue
+        if checkin.id in last_index:
+            statuses[last_index[checkin.id]] = STATUS_DUPLICATE
+        last_index[checkin.id] = index
+
+    to_write = sorted(last_index.values())
+    name_ids = name_dictionary.ids(db, (name for index in to_write for name in _checkin_names(checkins[index])))
+    partitioned = checkins_partitioned(db.connection())
+    stmt = insert(CheckInDB) if partitioned else _upsert_statement(db)
+    # До проверки существования: иначе две транзакции с одним новым ID обе
+    # не найдут его и вставят дубль (секции) или не учтут перезапись (latest_moods)
+    lock_keys(db, LOCK_CHECKIN_ID, last_index.keys())
+    written = []
+    replaced_ids = []
+    replaced_user_ids = set()
+    for start in range(0, len(to_write), CHECKIN_CHUNK_SIZE):
+        chunk = [checkins[index] for index in to_write[start:start + CHECKIN_CHUNK_SIZE]]
+        if partitioned:
+            ids_to_check = [checkin.id for checkin in chunk]
+        else:
+            ids_to_check, _ = checkin_id_filter.split(checkin.id for checkin in chunk)
+        existing_ids = set()
+        if ids_to_check:
+            existing = db.query(CheckInDB.id, CheckInDB.user_id).filter(CheckInDB.id.in_(ids_to_check)).all()
+            existing_ids = {checkin_id for checkin_id, _ in existing}
+            replaced_user_ids.update(user_id for _, user_id in existing)
+            if not partitioned:
+                checkin_id_filter.record_lookups(len(ids_to_check), len(existing_ids))
+        if partitioned and existing_ids:
+            db.execute(delete(CheckInDB).where(CheckInDB.id.in_(existing_ids)))
+        db.execute(stmt, [_checkin_row(checkin, name_ids) for checkin in chunk])
+        for index in to_write[start:start + CHECKIN_CHUNK_SIZE]:
+            statuses[index] = STATUS_UPDATED if checkins[index].id in existing_ids else STATUS_INSERTED
+        written.extend(chunk)
+        replaced_ids.extend(existing_ids)
+
+    record_checkins(db, written, replaced_ids, replaced_user_ids)
+    checkin_id_filter.add_many(
+        checkin.id for checkin, status in zip(checkins, statuses) if status == STATUS_INSERTED
+    )
+    return [
+        {"id": checkin.id, "status": status}
+        for checkin, status in zip(checkins, statuses)
+    ]
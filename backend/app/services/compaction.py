@@ -0,0 +1,226 @@
+"""
+Сворачивание старых чек-инов в дневные сводки
+
+Рейтинги читают только последние 30 дней; более старые чек-ины нужны лишь
+в агрегированном виде. Задача обслуживания (app/services/maintenance.py)
+для каждого дня старше CHECKINS_COMPACT_AFTER_DAYS:
+1. одной транзакцией строит сводку checkin_daily_stats (регион, город,
+   федеральный округ: гистограмма последних настроений пользователей за
+   день и число пользователей), сверяет ее с исходными строками и
+   отмечает день в checkin_compactions;
+2. удаляет свернутые чек-ины порциями по COMPACT_DELETE_CHUNK_SIZE
+   короткими транзакциями.
+
+Свернутыми считаются чек-ины дня, созданные не позже отметки compacted_at.
+Чек-ины за уже свернутый день, пришедшие позже (синхронизация из офлайна),
+сворачиваются при следующем запуске и добавляются к сводке как отдельные
+пользователи.
+"""
+import os
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional
+from sqlalchemy import String, and_, case, cast, delete, func, select
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import Connection, Engine
+from app.database import (
+    CheckInDB,
+    CheckInCompactionDB,
+    CheckInDailyStatsDB,
+    LatestMoodDB,
+    MoodBucketDB
+)
+from app.services.latest_moods import MOODS, _levels, LEVEL_REGION
+
+# Через сколько дней сворачивать чек-ины (0 - не сворачивать)
+CHECKINS_COMPACT_AFTER_DAYS = int(os.getenv("CHECKINS_COMPACT_AFTER_DAYS", "0"))
+# Рейтинг за месяц читает 30 дней - более свежие чек-ины сворачивать нельзя
+MIN_COMPACT_AFTER_DAYS = 31
+COMPACT_DELETE_CHUNK_SIZE = int(os.getenv("COMPACT_DELETE_CHUNK_SIZE", "1000"))
+
+# created_at может быть пустым у старых строк - такие строки считаются старыми
+_EPOCH = datetime(1970, 1, 1)
+
+
+class CompactionVerificationError(Exception):
+    """Сводка не сходится с исходными чек-инами"""
+
+
+def _insert(conn: Connection):
+    """insert() с поддержкой ON CONFLICT для текущей БД"""
+    if conn.dialect.name == "postgresql":
+        return postgresql.insert
+    return sqlite.insert
+
+
+def _day_filter(day: datetime):
+    return and_(CheckInDB.date >= day, CheckInDB.date < day + timedelta(days=1))
+
+
+def _created_at():
+    return func.coalesce(CheckInDB.created_at, _EPOCH)
+
+
+def _daily_rows(conn: Connection, day: datetime, rows_filter) -> List[dict]:
+    """Сводка дня по всем уровням: последний чек-ин пользователя за день в области"""
+    result = []
+    for level, key, name, region in _levels():
+        rank = func.row_number().over(
+            partition_by=[key, CheckInDB.user_id],
+            order_by=[CheckInDB.date.desc(), CheckInDB.id.desc()]
+        )
+        ranked = select(
+            key.label("area_id"),
+            name.label("area_name"),
+            cast(region, String).label("region_id"),
+            CheckInDB.mood,
+            rank.label("rank")
+        ).where(
+            rows_filter,
+            CheckInDB.user_id.isnot(None),
+            CheckInDB.user_id != "",
+            key.isnot(None)
+        ).subquery()
+        query = select(
+            ranked.c.area_id,
+            func.max(ranked.c.area_name),
+            func.max(ranked.c.region_id),
+            *[func.sum(case((ranked.c.mood == mood, 1), else_=0)) for mood in MOODS],
+            func.count()
+        ).where(ranked.c.rank == 1).group_by(ranked.c.area_id)
+        for area_id, area_name, region_id, *counts in conn.execute(query):
+            *moods, users = counts
+            result.append({
+                "day": day,
+                "level": level,
+                "area_id": area_id,
+                "area_name": area_name,
+                "region_id": region_id,
+                **{f"mood_{mood}": int(count) for mood, count in zip(MOODS, moods)},
+                "unique_users": int(users),
+            })
+    return result
+
+
+def _verify(conn: Connection, rows: List[dict], rows_filter):
+    """Сверить сводку с исходными строками перед удалением"""
+    for row in rows:
+        if sum(row[f"mood_{mood}"] for mood in MOODS) != row["unique_users"]:
+            raise CompactionVerificationError(f"гистограмма {row['level']} {row['area_id']} не сходится")
+    expected = conn.execute(
+        select(func.count()).select_from(
+            select(CheckInDB.region_id, CheckInDB.user_id).where(
+                rows_filter,
+                CheckInDB.user_id.isnot(None),
+                CheckInDB.user_id != ""
+            ).distinct().subquery()
+        )
+    ).scalar()
+    actual = sum(row["unique_users"] for row in rows if row["level"] == LEVEL_REGION)
+    if expected != actual:
+        raise CompactionVerificationError(f"пользователей по регионам {actual}, в чек-инах {expected}")
+
+
+def rollup_day(conn: Connection, day: datetime) -> datetime:
+    """
+    Добавить в сводку еще не свернутые чек-ины дня (в транзакции conn)
+
+    Returns:
+        Отметка compacted_at: чек-ины дня, созданные не позже нее, можно удалять
+    """
+    marker = conn.execute(
+        select(CheckInCompactionDB.compacted_at).where(CheckInCompactionDB.day == day)
+    ).scalar()
+    compacted_at = datetime.now(timezone.utc).replace(tzinfo=None)
+    rows_filter = and_(_day_filter(day), _created_at() <= compacted_at)
+    if marker is not None:
+        rows_filter = and_(rows_filter, _created_at() > marker)
+
+    raw_rows = conn.execute(select(func.count()).select_from(CheckInDB).where(rows_filter)).scalar()
+    rows = _daily_rows(conn, day, rows_filter)
+    _verify(conn, rows, rows_filter)
+
+    insert = _insert(conn)
+    if rows:
+        stmt = insert(CheckInDailyStatsDB)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["day", "level", "area_id"],
+            set_={
+                column: getattr(CheckInDailyStatsDB, column) + getattr(stmt.excluded, column)
+                for column in [f"mood_{mood}" for mood in MOODS] + ["unique_users"]
+            }
+        )
+        conn.execute(stmt, rows)
+    stmt = insert(CheckInCompactionDB)
+    conn.execute(
+        stmt.on_conflict_do_update(
+            index_elements=["day"],
+            set_={
+                "compacted_at": stmt.excluded.compacted_at,
+                "raw_rows": CheckInCompactionDB.raw_rows + stmt.excluded.raw_rows,
+            }
+        ),
+        {"day": day, "compacted_at": compacted_at, "raw_rows": raw_rows}
+    )
+    return compacted_at
+
+
+def delete_compacted(engine: Engine, day: datetime, compacted_at: datetime) -> int:
+    """Удалить свернутые чек-ины дня порциями (каждая порция - своя транзакция)"""
+    rows_filter = and_(_day_filter(day), _created_at() <= compacted_at)
+    deleted = 0
+    while True:
+        with engine.begin() as conn:
+            chunk = select(CheckInDB.id).where(rows_filter).limit(COMPACT_DELETE_CHUNK_SIZE)
+            count = conn.execute(delete(CheckInDB).where(rows_filter, CheckInDB.id.in_(chunk))).rowcount
+        deleted += count
+        if count < COMPACT_DELETE_CHUNK_SIZE:
+            return deleted
+
+
+def compact_checkins(engine: Engine, after_days: int, today: Optional[datetime] = None) -> dict:
+    """
+    Свернуть чек-ины старше after_days дней
+
+    Returns:
+        {"days": обработано дней, "deleted": удалено чек-инов}
+    """
+    if after_days < MIN_COMPACT_AFTER_DAYS:
+        print(f"[WARNING] Сворачивать можно чек-ины старше {MIN_COMPACT_AFTER_DAYS} дней, "
+              f"используется {MIN_COMPACT_AFTER_DAYS} вместо {after_days}")
+        after_days = MIN_COMPACT_AFTER_DAYS
+    today = today or datetime.now(timezone.utc).replace(tzinfo=None)
+    cutoff = today.replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(days=after_days)
+
+    days = 0
+    deleted = 0
+    next_day = _EPOCH
+    while True:
+        # Следующий день со старыми чек-инами (каждый день - не больше одного раза за запуск)
+        with engine.connect() as conn:
+            first = conn.execute(
+                select(func.min(CheckInDB.date)).where(CheckInDB.date >= next_day, CheckInDB.date < cutoff)
+            ).scalar()
+        if first is None:
+            break
+        day = first.replace(hour=0, minute=0, second=0, microsecond=0)
+        with engine.begin() as conn:
+            compacted_at = rollup_day(conn, day)
+        deleted += delete_compacted(engine, day, compacted_at)
+        days += 1
+        next_day = day + timedelta(days=1)
+
+    if days:
+        # Производные таблицы рейтингов не должны ссылаться на удаленные чек-ины
+        with engine.begin() as conn:
+            conn.execute(delete(LatestMoodDB).where(LatestMoodDB.date < cutoff))
+            conn.execute(delete(MoodBucketDB).where(MoodBucketDB.hour < cutoff))
+    return {"days": days, "deleted": deleted}
+
+
+def run_compaction(engine: Engine):
+    """Задача обслуживания: свернуть чек-ины старше CHECKINS_COMPACT_AFTER_DAYS"""
+    if CHECKINS_COMPACT_AFTER_DAYS <= 0:
+        return
+    result = compact_checkins(engine, CHECKINS_COMPACT_AFTER_DAYS)
+    if result["days"]:
+        print(f"[INFO] Свернуто дней: {result['days']}, удалено чек-инов: {result['deleted']}")
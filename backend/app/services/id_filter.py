@@ -0,0 +1,144 @@
+"""
+Фильтр Блума по ID чек-инов
+
+Почти все чек-ины приходят с новыми ID, но перед записью каждый из них
+проверялся запросом к БД. Фильтр хранит в памяти все записанные ID:
+если он отвечает "точно нет", проверка в БД пропускается. Ответ "возможно
+есть" (включая ложные срабатывания с вероятностью CHECKIN_ID_FILTER_FP_RATE)
+проверяется в БД как раньше.
+
+Фильтр заполняется при старте (все ID из checkins) и дополняется при записи.
+Он знает только о чек-инах, записанных этим процессом, поэтому по умолчанию
+выключен: включайте его (CHECKIN_ID_FILTER=on), только если процесс -
+единственный писатель в БД (один воркер SQLite), но не для нескольких
+воркеров/инстансов.
+"""
+import hashlib
+import math
+import os
+import threading
+from typing import Iterable
+from sqlalchemy.orm import Session
+from app.database import CheckInDB
+
+CHECKIN_ID_FILTER_ENABLED = os.getenv("CHECKIN_ID_FILTER", "off") == "on"
+# Ожидаемое число чек-инов и допустимая доля ложных срабатываний
+CHECKIN_ID_FILTER_CAPACITY = int(os.getenv("CHECKIN_ID_FILTER_CAPACITY", "1000000"))
+CHECKIN_ID_FILTER_FP_RATE = float(os.getenv("CHECKIN_ID_FILTER_FP_RATE", "0.01"))
+
+# Размер пачки ID при заполнении фильтра
+SEED_BATCH_SIZE = 10000
+
+
+class CheckInIdFilter:
+    """Фильтр Блума (bytearray + двойное хеширование blake2b)"""
+
+    def __init__(
+        self,
+        capacity: int = CHECKIN_ID_FILTER_CAPACITY,
+        fp_rate: float = CHECKIN_ID_FILTER_FP_RATE,
+        enabled: bool = CHECKIN_ID_FILTER_ENABLED
+    ):
+        self.enabled = enabled
+        self.capacity = capacity
+        self.fp_rate = fp_rate
+        # Оптимальные размер (бит) и число хеш-функций для capacity и fp_rate
+        self.size = max(8, math.ceil(-capacity * math.log(fp_rate) / math.log(2) ** 2))
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+        self._bits = bytearray((self.size + 7) // 8) if enabled else bytearray()
+        self._lock = threading.Lock()
+        # Пока фильтр не заполнен из БД, все ID проверяются в БД
+        self.ready = False
+        self.count = 0
+        self.lookups_skipped = 0
+        self.lookups_performed = 0
+        self.false_positives = 0
+
+    def _positions(self, checkin_id: str):
+        digest = hashlib.blake2b(checkin_id.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hash_count)]
+
+    def _add(self, checkin_id: str):
+        for position in self._positions(checkin_id):
+            self._bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+        if self.count == self.capacity + 1:
+            print(
+                f"[WARNING] В фильтре ID чек-инов больше {self.capacity} элементов, "
+                "доля ложных срабатываний растет - увеличьте CHECKIN_ID_FILTER_CAPACITY"
+            )
+
+    def add_many(self, checkin_ids: Iterable[str]):
+        """Добавить записанные ID (вызывается при записи чек-инов)"""
+        if not self.enabled:
+            return
+        with self._lock:
+            for checkin_id in checkin_ids:
+                self._add(checkin_id)
+
+    def might_contain(self, checkin_id: str) -> bool:
+        """False - ID точно нет в БД, True - нужно проверить в БД"""
+        if not self.enabled or not self.ready:
+            return True
+        bits = self._bits
+        return all(bits[position >> 3] & (1 << (position & 7)) for position in self._positions(checkin_id))
+
+    def split(self, checkin_ids: Iterable[str]):
+        """
+        Разделить ID на требующие проверки в БД и точно новые
+
+        Returns:
+            (ID для проверки в БД, точно новые ID)
+        """
+        to_check, new = [], []
+        for checkin_id in checkin_ids:
+            (to_check if self.might_contain(checkin_id) else new).append(checkin_id)
+        with self._lock:
+            self.lookups_skipped += len(new)
+        return to_check, new
+
+    def record_lookups(self, performed: int, found: int):
+        """Учесть проверки в БД: performed проверено, found из них нашлось"""
+        with self._lock:
+            self.lookups_performed += performed
+            if self.ready:
+                self.false_positives += performed - found
+
+    def seed(self, db: Session):
+        """Заполнить фильтр всеми ID из БД (вызывается при старте)"""
+        if not self.enabled:
+            return
+        if db.get_bind().dialect.name == "postgresql":
+            print("[WARNING] CHECKIN_ID_FILTER=on с PostgreSQL: фильтр корректен, "
+                  "только если в БД пишет один процесс")
+        with self._lock:
+            self._bits = bytearray(len(self._bits))
+            self.count = 0
+            for (checkin_id,) in db.query(CheckInDB.id).yield_per(SEED_BATCH_SIZE):
+                self._add(checkin_id)
+            self.ready = True
+
+    def clear(self):
+        """Очистить фильтр (после удаления всех чек-инов)"""
+        with self._lock:
+            self._bits = bytearray(len(self._bits))
+            self.count = 0
+
+    def stats(self) -> dict:
+        """Метрики для /api/health"""
+        return {
+            "enabled": self.enabled,
+            "ready": self.ready,
+            "count": self.count,
+            "capacity": self.capacity,
+            "fpRate": self.fp_rate,
+            "lookupsSkipped": self.lookups_skipped,
+            "lookupsPerformed": self.lookups_performed,
+            "falsePositives": self.false_positives,
+        }
+
+
+# Глобальный фильтр процесса
+checkin_id_filter = CheckInIdFilter()
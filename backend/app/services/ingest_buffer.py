@@ -0,0 +1,257 @@
+"""
+Буферизованный прием чек-инов (write-behind)
+
+В режиме CHECKIN_INGEST_MODE=buffered POST /api/checkins не пишет в БД сам:
+чек-ин кладется в ограниченную очередь в памяти, а фоновая задача
+записывает накопленные чек-ины пакетом (одна транзакция и один fsync на
+пакет) каждые CHECKIN_FLUSH_INTERVAL_MS миллисекунд или как только
+набралось CHECKIN_FLUSH_MAX_ROWS чек-инов.
+
+Гарантии записи (CHECKIN_DURABILITY):
+- "commit" - ответ клиенту после commit пакета с его чек-ином (group commit)
+- "ack" - ответ сразу после постановки в очередь; при падении процесса
+  чек-ины из очереди теряются (клиент хранит их локально и досинхронизирует)
+
+Если пакет не записался из-за временной ошибки (блокировка, deadlock,
+обрыв соединения), запись повторяется с растущей паузой. Если пакет так и
+не записался, он делится пополам и половины пишутся отдельно: один плохой
+чек-ин не мешает записи остальных. ID чек-инов, которые не удалось
+записать, выводятся в лог и, если задан CHECKIN_DEAD_LETTER_FILE,
+дописываются в этот файл в формате NDJSON (его можно отправить заново
+через POST /api/checkins/sync/stream).
+
+При остановке приложения очередь записывается полностью.
+"""
+import asyncio
+import json
+import os
+import time
+from datetime import datetime, timezone
+from typing import Callable, List, Optional, Tuple
+from sqlalchemy.exc import DBAPIError, InterfaceError, OperationalError, TimeoutError as PoolTimeoutError
+from sqlalchemy.orm import Session
+from app.database import SessionLocal
+from app.models.schemas import CheckInCreate
+from app.services.checkin_writer import upsert_checkins
+from app.services.ranking_cache import ranking_cache
+
+# Режим приема чек-инов: direct (запись в запросе) или buffered (через очередь)
+CHECKIN_INGEST_MODE = os.getenv("CHECKIN_INGEST_MODE", "direct")
+CHECKIN_DURABILITY = os.getenv("CHECKIN_DURABILITY", "commit")
+CHECKIN_BUFFER_MAX_SIZE = int(os.getenv("CHECKIN_BUFFER_MAX_SIZE", "10000"))
+CHECKIN_FLUSH_INTERVAL_MS = int(os.getenv("CHECKIN_FLUSH_INTERVAL_MS", "50"))
+CHECKIN_FLUSH_MAX_ROWS = int(os.getenv("CHECKIN_FLUSH_MAX_ROWS", "500"))
+# Сколько секунд ждать места в заполненной очереди, прежде чем отказать клиенту
+CHECKIN_BUFFER_PUT_TIMEOUT = float(os.getenv("CHECKIN_BUFFER_PUT_TIMEOUT", "1"))
+# Повторы записи пакета при временных ошибках БД: число повторов и первая пауза (удваивается)
+CHECKIN_FLUSH_RETRIES = int(os.getenv("CHECKIN_FLUSH_RETRIES", "3"))
+CHECKIN_FLUSH_RETRY_DELAY_MS = int(os.getenv("CHECKIN_FLUSH_RETRY_DELAY_MS", "100"))
+# Файл для чек-инов, которые не удалось записать (NDJSON); пусто - только лог
+CHECKIN_DEAD_LETTER_FILE = os.getenv("CHECKIN_DEAD_LETTER_FILE", "")
+
+DURABILITY_COMMIT = "commit"
+DURABILITY_ACK = "ack"
+
+# Сигнал остановки фоновой записи в очереди
+_STOP = object()
+
+Item = Tuple[CheckInCreate, Optional[asyncio.Future]]
+
+
+def _is_transient(error: Exception) -> bool:
+    """Может ли повтор той же записи пройти (блокировки, deadlock, соединение, пул)"""
+    if isinstance(error, (OperationalError, InterfaceError, PoolTimeoutError)):
+        return True
+    return isinstance(error, DBAPIError) and error.connection_invalidated
+
+
+class IngestBufferFull(Exception):
+    """Очередь чек-инов заполнена"""
+
+
+class CheckInIngestBuffer:
+    """Очередь чек-инов с фоновой пакетной записью"""
+
+    def __init__(
+        self,
+        enabled: bool = CHECKIN_INGEST_MODE == "buffered",
+        durability: str = CHECKIN_DURABILITY,
+        max_size: int = CHECKIN_BUFFER_MAX_SIZE,
+        flush_interval_ms: int = CHECKIN_FLUSH_INTERVAL_MS,
+        flush_max_rows: int = CHECKIN_FLUSH_MAX_ROWS,
+        session_factory: Callable[[], Session] = SessionLocal,
+        retries: int = CHECKIN_FLUSH_RETRIES,
+        retry_delay_ms: int = CHECKIN_FLUSH_RETRY_DELAY_MS,
+        dead_letter_file: str = CHECKIN_DEAD_LETTER_FILE
+    ):
+        if durability not in (DURABILITY_COMMIT, DURABILITY_ACK):
+            raise ValueError(f"Неизвестный режим CHECKIN_DURABILITY: {durability}")
+        self.enabled = enabled
+        self.durability = durability
+        self.max_size = max_size
+        self.flush_interval = flush_interval_ms / 1000
+        self.flush_max_rows = flush_max_rows
+        self._session_factory = session_factory
+        self.retries = retries
+        self.retry_delay = retry_delay_ms / 1000
+        self.dead_letter_file = dead_letter_file
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self.flushed_batches = 0
+        self.flushed_checkins = 0
+        self.failed_checkins = 0
+        self.retried_batches = 0
+        self.split_batches = 0
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None
+
+    def stats(self) -> dict:
+        """Состояние очереди для /api/health"""
+        return {
+            "mode": "buffered" if self.running else "direct",
+            "durability": self.durability,
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "flushedBatches": self.flushed_batches,
+            "flushedCheckIns": self.flushed_checkins,
+            "failedCheckIns": self.failed_checkins,
+            "retriedBatches": self.retried_batches,
+            "splitBatches": self.split_batches,
+        }
+
+    async def submit(self, checkin: CheckInCreate):
+        """
+        Поставить чек-ин в очередь
+
+        В режиме "commit" возвращается после записи пакета (ошибка записи
+        пробрасывается), в режиме "ack" - сразу после постановки в очередь.
+
+        Raises:
+            IngestBufferFull: очередь не освободилась за CHECKIN_BUFFER_PUT_TIMEOUT
+        """
+        future = None
+        if self.durability == DURABILITY_COMMIT:
+            future = asyncio.get_running_loop().create_future()
+        try:
+            await asyncio.wait_for(self._queue.put((checkin, future)), timeout=CHECKIN_BUFFER_PUT_TIMEOUT)
+        except asyncio.TimeoutError:
+            raise IngestBufferFull()
+        if future is not None:
+            await future
+
+    def _write(self, checkins: List[CheckInCreate]):
+        """Записать пакет одной транзакцией (выполняется в потоке)"""
+        db = self._session_factory()
+        try:
+            upsert_checkins(db, checkins)
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    async def _write_with_retry(self, batch: List[Item]):
+        """Записать пакет, повторяя запись при временных ошибках с растущей паузой"""
+        delay = self.retry_delay
+        for attempt in range(self.retries + 1):
+            try:
+                await asyncio.to_thread(self._write, [checkin for checkin, _ in batch])
+                return
+            except Exception as e:
+                if attempt == self.retries or not _is_transient(e):
+                    raise
+                self.retried_batches += 1
+                print(f"[WARNING] Временная ошибка записи пакета из {len(batch)} чек-инов "
+                      f"(попытка {attempt + 1}), повтор через {delay * 1000:.0f} мс: {e}")
+                await asyncio.sleep(delay)
+                delay *= 2
+
+    async def _flush(self, batch: List[Item]):
+        """Записать пакет; если не получилось - записать половины по отдельности"""
+        try:
+            await self._write_with_retry(batch)
+        except Exception as e:
+            if len(batch) > 1:
+                self.split_batches += 1
+                middle = len(batch) // 2
+                await self._flush(batch[:middle])
+                await self._flush(batch[middle:])
+                return
+            self._drop(batch[0], e)
+            return
+        self.flushed_batches += 1
+        self.flushed_checkins += len(batch)
+        ranking_cache.invalidate()
+        for _, future in batch:
+            if future is not None and not future.done():
+                future.set_result(None)
+
+    def _drop(self, item: Item, error: Exception):
+        """Отказаться от чек-ина, который не записывается даже один"""
+        checkin, future = item
+        self.failed_checkins += 1
+        print(f"[ERROR] Чек-ин {checkin.id} не записан: {error}")
+        if self.dead_letter_file:
+            record = json.loads(checkin.model_dump_json(by_alias=True))
+            record["_error"] = str(error)
+            record["_failedAt"] = datetime.now(timezone.utc).isoformat()
+            try:
+                with open(self.dead_letter_file, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            except OSError as write_error:
+                print(f"[ERROR] Не удалось сохранить чек-ин {checkin.id} в {self.dead_letter_file}: {write_error}")
+        if future is not None and not future.done():
+            future.set_exception(error)
+
+    async def _collect(self) -> Tuple[List[Item], bool]:
+        """Дождаться первого чек-ина и добрать пакет до лимита строк или времени
+
+        Returns:
+            (пакет, пришел ли сигнал остановки)
+        """
+        item = await self._queue.get()
+        if item is _STOP:
+            return [], True
+        batch = [item]
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.flush_max_rows:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                item = await asyncio.wait_for(self._queue.get(), timeout=timeout)
+            except asyncio.TimeoutError:
+                break
+            if item is _STOP:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    async def _run(self):
+        stopping = False
+        while not stopping:
+            batch, stopping = await self._collect()
+            if batch:
+                await self._flush(batch)
+
+    async def start(self):
+        """Запустить фоновую запись (вызывается в lifespan)"""
+        if not self.enabled or self._task is not None:
+            return
+        self._queue = asyncio.Queue(maxsize=self.max_size)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Остановить фоновую запись, предварительно записав все, что осталось в очереди"""
+        if self._task is None:
+            return
+        # Сигнал остановки встает в очередь последним: все чек-ины перед ним будут записаны
+        await self._queue.put(_STOP)
+        await self._task
+        self._task = None
+
+
+# Глобальный экземпляр процесса
+ingest_buffer = CheckInIngestBuffer()
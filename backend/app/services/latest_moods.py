@@ -0,0 +1,373 @@
+"""
+Последнее настроение каждого пользователя по областям
+
+Правило рейтинга: один пользователь считается один раз, учитывается его
+последний чек-ин. Вместо пересчета по всем чек-инам на каждый запрос
+таблица latest_moods хранит последний чек-ин пользователя для каждого
+региона, города и федерального округа и обновляется при записи чек-инов.
+
+Поверх нее ведутся почасовые гистограммы mood_buckets: пользователь
+учитывается в ячейке часа своего последнего чек-ина в области.
+"""
+from typing import Iterable
+from sqlalchemy import func, case, literal, select, tuple_
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+from app.database import CheckInDB, LatestMoodDB, MoodBucketDB, to_utc_naive
+from app.services.name_dictionary import name_expr
+from app.services.advisory_locks import LOCK_USER, lock_keys
+
+LEVEL_REGION = "region"
+LEVEL_CITY = "city"
+LEVEL_FEDERAL_DISTRICT = "federal_district"
+
+MOODS = (1, 2, 3, 4, 5)
+
+# Количество строк в одном INSERT (ограничение числа параметров SQLite)
+UPSERT_CHUNK_SIZE = 500
+# Размер пачки строк при потоковом чтении
+STREAM_BATCH_SIZE = 1000
+
+
+def city_key():
+    """Ключ города: city_id или "<region_id>_<city_name>", NULL если у чек-ина нет города"""
+    return case(
+        (
+            CheckInDB.city_name_id.isnot(None),
+            func.coalesce(CheckInDB.city_id, CheckInDB.region_id + "_" + name_expr(CheckInDB.city_name_id))
+        ),
+        else_=None
+    )
+
+
+def federal_district_key():
+    """Ключ федерального округа (его название), NULL если округ не указан"""
+    return name_expr(CheckInDB.federal_district_id)
+
+
+def _levels():
+    """Уровни: (level, ключ области, название области, регион) в виде SQL-выражений"""
+    return [
+        (LEVEL_REGION, CheckInDB.region_id, name_expr(CheckInDB.region_name_id), CheckInDB.region_id),
+        (LEVEL_CITY, city_key(), name_expr(CheckInDB.city_name_id), CheckInDB.region_id),
+        (LEVEL_FEDERAL_DISTRICT, federal_district_key(), federal_district_key(), literal(None)),
+    ]
+
+
+def _area_keys(checkin):
+    """Области чек-ина: [(level, area_id, area_name, region_id)]
+
+    Принимает записываемый чек-ин (CheckInCreate): ключи областей - region_id,
+    city_id и название федерального округа, названия - из самого чек-ина
+    (в CheckInDB вместо названий только ключи словаря name_dictionary)
+    """
+    keys = [(LEVEL_REGION, checkin.region_id, checkin.region_name, checkin.region_id)]
+    if checkin.city_name:
+        city_id = checkin.city_id
+        if city_id is None:
+            city_id = f"{checkin.region_id}_{checkin.city_name}"
+        keys.append((LEVEL_CITY, city_id, checkin.city_name, checkin.region_id))
+    if checkin.federal_district:
+        keys.append((LEVEL_FEDERAL_DISTRICT, checkin.federal_district, checkin.federal_district, None))
+    return keys
+
+
+def _date_key(date):
+    """Дата для сравнения в Python - в UTC без часового пояса, как в БД (NaiveDateTime)"""
+    return to_utc_naive(date)
+
+
+def bucket_hour(date):
+    """Начало часа, в ячейку которого попадает дата"""
+    return _date_key(date).replace(minute=0, second=0, microsecond=0)
+
+
+def _insert(db: Session, model):
+    """INSERT с поддержкой ON CONFLICT для текущей БД"""
+    if db.get_bind().dialect.name == "postgresql":
+        return postgresql.insert(model)
+    return sqlite.insert(model)
+
+
+def _chunks(items: list, size: int = UPSERT_CHUNK_SIZE):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def _latest_row(key: tuple, area_name: str, region_id, checkin_id: str, mood: int, date) -> dict:
+    level, area_id, user_id = key
+    return {
+        "level": level,
+        "area_id": area_id,
+        "user_id": user_id,
+        "area_name": area_name,
+        "region_id": region_id,
+        "checkin_id": checkin_id,
+        "mood": mood,
+        "date": date,
+    }
+
+
+def _load_latest(db: Session, keys: list) -> dict:
+    """Текущие строки latest_moods для ключей (level, area_id, user_id)"""
+    existing = {}
+    for chunk in _chunks(keys):
+        rows = db.query(
+            LatestMoodDB.level,
+            LatestMoodDB.area_id,
+            LatestMoodDB.user_id,
+            LatestMoodDB.area_name,
+            LatestMoodDB.region_id,
+            LatestMoodDB.checkin_id,
+            LatestMoodDB.mood,
+            LatestMoodDB.date
+        ).filter(
+            tuple_(LatestMoodDB.level, LatestMoodDB.area_id, LatestMoodDB.user_id).in_(chunk)
+        ).all()
+        for row in rows:
+            key = (row[0], row[1], row[2])
+            existing[key] = _latest_row(key, *row[3:])
+    return existing
+
+
+def _recompute(db: Session, keys: Iterable[tuple]) -> dict:
+    """Заново найти последний чек-ин для (level, area_id, user_id) по таблице checkins
+
+    Returns:
+        {key: строка latest_moods или None, если чек-инов в области не осталось}
+    """
+    area_columns = {level: (key, name, region) for level, key, name, region in _levels()}
+    result = {}
+    for level, area_id, user_id in keys:
+        key, name, region = area_columns[level]
+        latest = db.query(
+            name, region, CheckInDB.id, CheckInDB.mood, CheckInDB.date
+        ).filter(
+            CheckInDB.user_id == user_id,
+            key == area_id
+        ).order_by(CheckInDB.date.desc()).first()
+        area_key = (level, area_id, user_id)
+        result[area_key] = _latest_row(area_key, *latest) if latest else None
+    return result
+
+
+def _add_to_buckets(buckets: dict, row: dict, delta: int):
+    """Учесть строку latest_moods в изменениях почасовых гистограмм"""
+    key = (row["level"], row["area_id"], bucket_hour(row["date"]))
+    bucket = buckets.get(key)
+    if bucket is None:
+        bucket = buckets[key] = {
+            "level": row["level"],
+            "area_id": row["area_id"],
+            "hour": key[2],
+            "area_name": row["area_name"],
+            "region_id": row["region_id"],
+            **{f"mood_{mood}": 0 for mood in MOODS},
+        }
+    if delta > 0:
+        bucket["area_name"] = row["area_name"]
+        bucket["region_id"] = row["region_id"]
+    bucket[f"mood_{row['mood']}"] += delta
+
+
+def _apply_bucket_deltas(db: Session, buckets: dict):
+    """Прибавить изменения к счетчикам mood_buckets"""
+    # Строки в порядке ключа: параллельные транзакции блокируют общие ячейки в одном порядке
+    rows = [
+        buckets[key] for key in sorted(buckets)
+        if any(buckets[key][f"mood_{mood}"] for mood in MOODS)
+    ]
+    for chunk in _chunks(rows):
+        stmt = _insert(db, MoodBucketDB).values(chunk)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["level", "area_id", "hour"],
+            set_={
+                "area_name": stmt.excluded.area_name,
+                "region_id": stmt.excluded.region_id,
+                **{
+                    f"mood_{mood}": getattr(MoodBucketDB, f"mood_{mood}") + getattr(stmt.excluded, f"mood_{mood}")
+                    for mood in MOODS
+                },
+            }
+        )
+        db.execute(stmt)
+
+
+def record_checkins(
+    db: Session,
+    checkins: list,
+    replaced_ids: Iterable[str] = (),
+    replaced_user_ids: Iterable[str] = ()
+):
+    """
+    Обновить latest_moods и mood_buckets после записи чек-инов
+    (в той же транзакции, до commit)
+
+    Args:
+        db: Сессия базы данных
+        checkins: Записанные чек-ины (CheckInCreate, с названиями)
+        replaced_ids: ID чек-инов, которые существовали раньше и были перезаписаны
+        replaced_user_ids: Пользователи этих чек-инов до перезаписи
+    """
+    db.flush()
+
+    # Повторяющиеся ID внутри пакета: в checkins записан последний вариант,
+    # учитывается только он (иначе старый вариант попадет в области, где чек-ина нет)
+    latest_by_id = {}
+    for checkin in reversed(checkins):
+        latest_by_id.setdefault(checkin.id, checkin)
+    checkins = list(reversed(latest_by_id.values()))
+
+    # Последний чек-ин каждого пользователя в каждой области внутри пакета
+    candidates = {}  # {(level, area_id, user_id): строка latest_moods}
+    for checkin in checkins:
+        if not checkin.user_id or checkin.user_id.strip() == "":
+            continue
+        for level, area_id, area_name, region_id in _area_keys(checkin):
+            key = (level, area_id, checkin.user_id)
+            current = candidates.get(key)
+            if current is None or _date_key(checkin.date) >= _date_key(current["date"]):
+                candidates[key] = _latest_row(key, area_name, region_id, checkin.id, checkin.mood, checkin.date)
+
+    # Изменения mood_buckets считаются от прочитанных строк latest_moods: параллельные
+    # транзакции одного пользователя должны читать их по очереди, иначе обе вычтут
+    # одну и ту же старую строку. Блокировки пользователей держатся до commit
+    lock_keys(db, LOCK_USER, {key[2] for key in candidates} | set(replaced_user_ids))
+
+    # Перезаписанный чек-ин мог быть последним у пользователя в старой области:
+    # такие ключи пересчитываются по таблице checkins (она уже содержит новые данные).
+    # Строки ищутся после блокировки: до нее параллельная транзакция пользователя
+    # могла еще не записать строку со ссылкой на перезаписанный чек-ин
+    stale = set()
+    replaced_ids = list(replaced_ids)
+    if replaced_ids:
+        stale = {
+            tuple(row) for row in db.query(
+                LatestMoodDB.level, LatestMoodDB.area_id, LatestMoodDB.user_id
+            ).filter(LatestMoodDB.checkin_id.in_(replaced_ids))
+        }
+        # Без replaced_user_ids пользователи строк блокируются здесь
+        lock_keys(db, LOCK_USER, {key[2] for key in stale})
+    recomputed = _recompute(db, stale) if stale else {}
+
+    keys = candidates.keys() | recomputed.keys()
+    existing = _load_latest(db, list(keys))
+
+    upserts = []
+    deletes = []
+    buckets = {}  # {(level, area_id, hour): изменения гистограммы}
+    for key in keys:
+        old = existing.get(key)
+        if key in recomputed:
+            new = recomputed[key]
+        else:
+            new = candidates[key]
+            if old is not None and _date_key(new["date"]) < _date_key(old["date"]):
+                continue  # В БД уже есть более свежий чек-ин
+        if old is not None:
+            _add_to_buckets(buckets, old, -1)
+        if new is None:
+            deletes.append(key)
+            continue
+        _add_to_buckets(buckets, new, 1)
+        upserts.append(new)
+
+    upserts.sort(key=lambda row: (row["level"], row["area_id"], row["user_id"]))
+    for chunk in _chunks(upserts):
+        stmt = _insert(db, LatestMoodDB).values(chunk)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["level", "area_id", "user_id"],
+            set_={
+                "area_name": stmt.excluded.area_name,
+                "region_id": stmt.excluded.region_id,
+                "checkin_id": stmt.excluded.checkin_id,
+                "mood": stmt.excluded.mood,
+                "date": stmt.excluded.date,
+            }
+        )
+        db.execute(stmt)
+    for chunk in _chunks(deletes):
+        db.query(LatestMoodDB).filter(
+            tuple_(LatestMoodDB.level, LatestMoodDB.area_id, LatestMoodDB.user_id).in_(chunk)
+        ).delete(synchronize_session=False)
+    _apply_bucket_deltas(db, buckets)
+
+
+def rebuild_latest_moods(db: Session):
+    """Полностью пересобрать latest_moods из таблицы checkins (в одной транзакции)"""
+    db.query(LatestMoodDB).delete(synchronize_session=False)
+    for level, key, name, region in _levels():
+        rank = func.row_number().over(
+            partition_by=[key, CheckInDB.user_id],
+            order_by=CheckInDB.date.desc()
+        )
+        ranked = select(
+            key.label("area_id"),
+            CheckInDB.user_id,
+            name.label("area_name"),
+            region.label("region_id"),
+            CheckInDB.id.label("checkin_id"),
+            CheckInDB.mood,
+            CheckInDB.date,
+            rank.label("rank")
+        ).where(
+            CheckInDB.user_id.isnot(None),
+            CheckInDB.user_id != "",
+            key.isnot(None)
+        ).subquery()
+        db.execute(
+            LatestMoodDB.__table__.insert().from_select(
+                ["level", "area_id", "user_id", "area_name", "region_id", "checkin_id", "mood", "date"],
+                select(
+                    literal(level),
+                    ranked.c.area_id,
+                    ranked.c.user_id,
+                    ranked.c.area_name,
+                    ranked.c.region_id,
+                    ranked.c.checkin_id,
+                    ranked.c.mood,
+                    ranked.c.date
+                ).where(ranked.c.rank == 1)
+            )
+        )
+
+
+def rebuild_mood_buckets(db: Session):
+    """Полностью пересобрать mood_buckets из latest_moods (в одной транзакции)"""
+    db.query(MoodBucketDB).delete(synchronize_session=False)
+    buckets = {}
+    rows = db.query(
+        LatestMoodDB.level,
+        LatestMoodDB.area_id,
+        LatestMoodDB.area_name,
+        LatestMoodDB.region_id,
+        LatestMoodDB.mood,
+        LatestMoodDB.date
+    ).order_by(LatestMoodDB.date).yield_per(STREAM_BATCH_SIZE)
+    for level, area_id, area_name, region_id, mood, date in rows:
+        _add_to_buckets(buckets, {
+            "level": level,
+            "area_id": area_id,
+            "area_name": area_name,
+            "region_id": region_id,
+            "mood": mood,
+            "date": date,
+        }, 1)
+    _apply_bucket_deltas(db, buckets)
+
+
+def init_latest_moods(db: Session):
+    """Заполнить latest_moods и mood_buckets при первом запуске, если чек-ины уже есть"""
+    try:
+        if db.query(LatestMoodDB.user_id).first() is None:
+            if db.query(CheckInDB.id).first() is None:
+                return
+            rebuild_latest_moods(db)
+            rebuild_mood_buckets(db)
+            db.commit()
+        elif db.query(MoodBucketDB.hour).first() is None:
+            rebuild_mood_buckets(db)
+            db.commit()
+    except Exception as e:
+        db.rollback()
+        print(f"[WARNING] Не удалось заполнить latest_moods: {e}")
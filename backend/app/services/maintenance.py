@@ -0,0 +1,76 @@
+"""
+Периодическое обслуживание базы данных
+
+Задача asyncio, запускаемая в lifespan приложения: при старте и затем
+каждые MAINTENANCE_INTERVAL секунд по очереди выполняет задачи
+обслуживания (в отдельном потоке, с синхронным engine).
+"""
+import asyncio
+import os
+from typing import Callable, List, Optional, Tuple
+from sqlalchemy.engine import Engine
+from app.database import engine
+from app.services.compaction import run_compaction
+from app.services.partitions import run_partition_maintenance
+
+# Интервал обслуживания в секундах (0 - выключено)
+MAINTENANCE_INTERVAL = float(os.getenv("MAINTENANCE_INTERVAL", "3600"))
+
+
+class MaintenanceLoop:
+    """Периодический запуск задач обслуживания"""
+
+    def __init__(
+        self,
+        jobs: List[Tuple[str, Callable[[Engine], None]]],
+        interval: float = MAINTENANCE_INTERVAL,
+        bind: Engine = engine
+    ):
+        self.jobs = jobs
+        self.interval = interval
+        self._bind = bind
+        self._task: Optional[asyncio.Task] = None
+        self._stopping: Optional[asyncio.Event] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.interval > 0
+
+    def run_all(self):
+        """Выполнить все задачи по порядку (синхронно); ошибка одной не останавливает остальные"""
+        for name, job in self.jobs:
+            try:
+                job(self._bind)
+            except Exception as e:
+                print(f"[WARNING] Ошибка задачи обслуживания {name}: {e}")
+
+    async def _run(self):
+        while not self._stopping.is_set():
+            await asyncio.to_thread(self.run_all)
+            try:
+                await asyncio.wait_for(self._stopping.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def start(self):
+        """Запустить обслуживание (вызывается в lifespan)"""
+        if not self.enabled or self._task is not None:
+            return
+        self._stopping = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Остановить обслуживание, дождавшись текущей задачи"""
+        if self._task is None:
+            return
+        self._stopping.set()
+        await self._task
+        self._task = None
+
+
+# Глобальный экземпляр процесса
+# Сворачивание - до удаления старых секций: их чек-ины сначала попадают в сводку
+maintenance = MaintenanceLoop([
+    ("compaction", run_compaction),
+    ("partitions", run_partition_maintenance),
+])
@@ -0,0 +1,128 @@
+"""
+Словарь названий для чек-инов
+
+Названия региона, города, федерального округа и района хранятся в
+checkins целочисленными ключами таблицы name_dictionary. Словарь целиком
+держится в памяти процесса: названия для ответов берутся из него без
+обращения к БД.
+
+Новые названия добавляются в той же транзакции, что и чек-ины
+(INSERT ... ON CONFLICT DO NOTHING). В общий кэш процесса они попадают
+только после commit, поэтому откат транзакции не оставляет в кэше ключей,
+которых нет в БД.
+"""
+import threading
+from typing import Dict, Iterable, Optional
+from sqlalchemy import event, select
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+from app.database import NameDB
+
+# Ключ session.info с названиями, добавленными в текущей транзакции
+_PENDING_KEY = "name_dictionary_pending"
+# Количество названий в одном INSERT и ключей в одном IN (...)
+INSERT_CHUNK_SIZE = 500
+
+
+def name_expr(column):
+    """SQL-выражение: название по ключу словаря (для запросов, собирающих названия в БД)"""
+    return select(NameDB.value).where(NameDB.id == column).scalar_subquery()
+
+
+class NameDictionary:
+    """Кэш словаря названий: название <-> ключ"""
+
+    def __init__(self):
+        self._ids: Dict[str, int] = {}
+        self._names: Dict[int, str] = {}
+        self._lock = threading.Lock()
+
+    def load(self, db: Session):
+        """Загрузить словарь целиком (вызывается при старте)"""
+        rows = db.query(NameDB.id, NameDB.value).all()
+        with self._lock:
+            for name_id, value in rows:
+                self._ids[value] = name_id
+                self._names[name_id] = value
+
+    def names(self, db: Session, name_ids: Iterable[Optional[int]]) -> Dict[int, str]:
+        """
+        Названия по ключам
+
+        Ключи, которых нет в кэше (записаны другим процессом), читаются
+        одним запросом IN (...) на порцию через сессию db вызывающего кода
+
+        Returns:
+            {ключ: название} для всех найденных непустых ключей
+        """
+        result = {}
+        missing = set()
+        for name_id in name_ids:
+            if name_id is None or name_id in result:
+                continue
+            value = self._names.get(name_id)
+            if value is None:
+                missing.add(name_id)
+            else:
+                result[name_id] = value
+        if missing:
+            values = sorted(missing)
+            loaded = {}
+            for start in range(0, len(values), INSERT_CHUNK_SIZE):
+                chunk = values[start:start + INSERT_CHUNK_SIZE]
+                loaded.update(db.query(NameDB.id, NameDB.value).filter(NameDB.id.in_(chunk)).all())
+            with self._lock:
+                for name_id, value in loaded.items():
+                    self._ids[value] = name_id
+                    self._names[name_id] = value
+            result.update(loaded)
+        return result
+
+    def ids(self, db: Session, names: Iterable[Optional[str]]) -> Dict[str, int]:
+        """
+        Ключи для названий, недостающие добавляются в словарь (в транзакции db)
+
+        Returns:
+            {название: ключ} для всех переданных непустых названий
+        """
+        pending = db.info.setdefault(_PENDING_KEY, {})
+        result = {}
+        missing = set()
+        for value in names:
+            if value is None or value in result:
+                continue
+            name_id = self._ids.get(value) or pending.get(value)
+            if name_id is None:
+                missing.add(value)
+            else:
+                result[value] = name_id
+        if missing:
+            insert = postgresql.insert if db.get_bind().dialect.name == "postgresql" else sqlite.insert
+            values = sorted(missing)
+            for start in range(0, len(values), INSERT_CHUNK_SIZE):
+                chunk = values[start:start + INSERT_CHUNK_SIZE]
+                db.execute(insert(NameDB).values([{"value": value} for value in chunk]).on_conflict_do_nothing(
+                    index_elements=["value"]
+                ))
+                for name_id, value in db.query(NameDB.id, NameDB.value).filter(NameDB.value.in_(chunk)):
+                    pending[value] = name_id
+                    result[value] = name_id
+        return result
+
+    def _publish(self, session: Session):
+        pending = session.info.pop(_PENDING_KEY, None)
+        if pending:
+            with self._lock:
+                for value, name_id in pending.items():
+                    self._ids[value] = name_id
+                    self._names[name_id] = value
+
+    def _discard(self, session: Session):
+        session.info.pop(_PENDING_KEY, None)
+
+
+# Глобальный словарь процесса
+name_dictionary = NameDictionary()
+
+event.listen(Session, "after_commit", name_dictionary._publish)
+event.listen(Session, "after_rollback", name_dictionary._discard)
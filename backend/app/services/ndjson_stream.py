@@ -0,0 +1,66 @@
+"""
+Потоковое чтение NDJSON (одна JSON-запись на строку)
+
+Тело запроса читается частями по мере поступления и, если нужно,
+распаковывается из gzip. Одновременно в памяти находится не больше одной
+части тела и одной незавершенной строки.
+"""
+import zlib
+from typing import AsyncIterable, AsyncIterator, Tuple
+
+# Максимальная длина строки NDJSON (байт), защищает от тела без переводов строк
+NDJSON_MAX_LINE_BYTES = 64 * 1024
+# Максимальный объем распакованных данных за один шаг
+GZIP_MAX_CHUNK_BYTES = 256 * 1024
+
+
+class NDJSONError(Exception):
+    """Тело запроса не удалось прочитать как NDJSON"""
+
+
+async def _decompressed(chunks: AsyncIterable[bytes]) -> AsyncIterator[bytes]:
+    """Распаковать поток gzip частями не больше GZIP_MAX_CHUNK_BYTES"""
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    try:
+        async for chunk in chunks:
+            data = chunk
+            while data:
+                output = decompressor.decompress(data, GZIP_MAX_CHUNK_BYTES)
+                if output:
+                    yield output
+                data = decompressor.unconsumed_tail
+        tail = decompressor.flush()
+    except zlib.error as e:
+        raise NDJSONError(f"Некорректные данные gzip: {e}")
+    if tail:
+        yield tail
+    if not decompressor.eof:
+        raise NDJSONError("Данные gzip обрываются")
+
+
+async def iter_ndjson_lines(chunks: AsyncIterable[bytes], gzip: bool = False) -> AsyncIterator[Tuple[int, bytes]]:
+    """
+    Строки NDJSON из потока байт
+
+    Args:
+        chunks: Части тела запроса (request.stream())
+        gzip: Тело сжато gzip (Content-Encoding: gzip)
+
+    Yields:
+        (номер строки с 1, строка без перевода строки); пустые строки пропускаются
+    """
+    if gzip:
+        chunks = _decompressed(chunks)
+    buffer = b""
+    line_number = 0
+    async for chunk in chunks:
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            line_number += 1
+            if line.strip():
+                yield line_number, line
+        if len(buffer) > NDJSON_MAX_LINE_BYTES:
+            raise NDJSONError(f"Строка {line_number + 1} длиннее {NDJSON_MAX_LINE_BYTES} байт")
+    if buffer.strip():
+        yield line_number + 1, buffer
@@ -0,0 +1,226 @@
+"""
+Секционирование таблицы checkins по месяцам (только PostgreSQL)
+
+При CHECKINS_PARTITIONING=on таблица checkins - секционированная по
+диапазону date (PARTITION BY RANGE), по одной секции на месяц
+(checkins_pYYYYMM) и секция по умолчанию checkins_default для дат вне
+созданных секций. Запросы статистики с условием по date читают только
+секции нужного периода.
+
+Обслуживание (app/services/maintenance.py):
+- создаются секции прошлого, текущего и CHECKINS_PARTITIONS_AHEAD следующих
+  месяцев (окно рейтингов в 30 дней захватывает прошлый месяц)
+- при CHECKINS_RETENTION_MONTHS > 0 секции старше срока хранения
+  отсоединяются и удаляются
+
+Первичный ключ секционированной таблицы - (id, date), поэтому upsert
+по id (ON CONFLICT (id)) невозможен: существующий чек-ин удаляется и
+вставляется заново (см. app/services/checkin_writer.py).
+
+Существующая таблица переводится на секции скриптом
+scripts/partition_checkins.py (пустая - автоматически при старте).
+"""
+import os
+import re
+from datetime import date, datetime, timezone
+from typing import List, Optional, Tuple
+from sqlalchemy import text
+from sqlalchemy.engine import Connection, Engine
+from app.database import CheckInDB, LatestMoodDB, MoodBucketDB
+
+CHECKINS_PARTITIONING = os.getenv("CHECKINS_PARTITIONING", "off") == "on"
+# Сколько месяцев вперед держать созданные секции
+CHECKINS_PARTITIONS_AHEAD = int(os.getenv("CHECKINS_PARTITIONS_AHEAD", "3"))
+# Срок хранения чек-инов в месяцах (0 - хранить всегда)
+CHECKINS_RETENTION_MONTHS = int(os.getenv("CHECKINS_RETENTION_MONTHS", "0"))
+# Насколько далеко в прошлое создавать секции при переводе таблицы (старее - в checkins_default)
+CONVERT_MONTHS_BACK = 24
+
+DEFAULT_PARTITION = "checkins_default"
+_PARTITION_NAME = re.compile(r"^checkins_p(\d{4})(\d{2})$")
+
+# Секционирована ли checkins (определяется один раз на процесс)
+_partitioned: Optional[bool] = None
+
+
+def _month_start(day) -> date:
+    return date(day.year, day.month, 1)
+
+
+def _add_months(month: date, count: int) -> date:
+    index = month.year * 12 + month.month - 1 + count
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(month: date) -> str:
+    return f"checkins_p{month.year}{month.month:02d}"
+
+
+def is_partitioned(conn: Connection) -> bool:
+    """Является ли checkins секционированной таблицей"""
+    if conn.dialect.name != "postgresql":
+        return False
+    relkind = conn.execute(text("SELECT relkind FROM pg_class WHERE oid = to_regclass('checkins')")).scalar()
+    return relkind == "p"
+
+
+def checkins_partitioned(conn: Connection) -> bool:
+    """Закэшированный на процесс is_partitioned"""
+    global _partitioned
+    if _partitioned is None:
+        _partitioned = is_partitioned(conn)
+    return _partitioned
+
+
+def list_partitions(conn: Connection) -> List[Tuple[str, Optional[date]]]:
+    """Секции checkins: [(имя, месяц или None для прочих секций)]"""
+    rows = conn.execute(text(
+        "SELECT child.relname FROM pg_inherits "
+        "JOIN pg_class parent ON pg_inherits.inhparent = parent.oid "
+        "JOIN pg_class child ON pg_inherits.inhrelid = child.oid "
+        "WHERE parent.relname = 'checkins' ORDER BY child.relname"
+    ))
+    partitions = []
+    for (name,) in rows:
+        match = _PARTITION_NAME.match(name)
+        partitions.append((name, date(int(match.group(1)), int(match.group(2)), 1) if match else None))
+    return partitions
+
+
+def _create_default_partition(conn: Connection):
+    conn.execute(text(f"CREATE TABLE IF NOT EXISTS {DEFAULT_PARTITION} PARTITION OF checkins DEFAULT"))
+
+
+def create_partition(conn: Connection, month: date) -> bool:
+    """
+    Создать секцию месяца, если ее нет
+
+    Чек-ины этого месяца, уже попавшие в checkins_default, переносятся
+    в новую секцию.
+
+    Returns:
+        True, если секция создана
+    """
+    name = partition_name(month)
+    if conn.execute(text("SELECT to_regclass(:name)"), {"name": name}).scalar() is not None:
+        return False
+    bounds = {"start": datetime.combine(month, datetime.min.time()),
+              "end": datetime.combine(_add_months(month, 1), datetime.min.time())}
+    values = f"FOR VALUES FROM ('{bounds['start']:%Y-%m-%d}') TO ('{bounds['end']:%Y-%m-%d}')"
+    has_default = conn.execute(text("SELECT to_regclass(:name)"), {"name": DEFAULT_PARTITION}).scalar() is not None
+    in_default = has_default and conn.execute(
+        text(f"SELECT 1 FROM {DEFAULT_PARTITION} WHERE date >= :start AND date < :end LIMIT 1"), bounds
+    ).first() is not None
+    if not in_default:
+        conn.execute(text(f"CREATE TABLE {name} PARTITION OF checkins {values}"))
+        return True
+    # Секцию нельзя создать, пока ее строки лежат в секции по умолчанию
+    conn.execute(text(f"ALTER TABLE checkins DETACH PARTITION {DEFAULT_PARTITION}"))
+    conn.execute(text(f"CREATE TABLE {name} PARTITION OF checkins {values}"))
+    conn.execute(text(
+        f"INSERT INTO {name} SELECT * FROM {DEFAULT_PARTITION} WHERE date >= :start AND date < :end"
+    ), bounds)
+    conn.execute(text(f"DELETE FROM {DEFAULT_PARTITION} WHERE date >= :start AND date < :end"), bounds)
+    conn.execute(text(f"ALTER TABLE checkins ATTACH PARTITION {DEFAULT_PARTITION} DEFAULT"))
+    return True
+
+
+def ensure_partitions(conn: Connection, today: date) -> List[str]:
+    """Создать секции прошлого, текущего и следующих месяцев; вернуть имена созданных"""
+    _create_default_partition(conn)
+    current = _month_start(today)
+    created = []
+    for offset in range(-1, CHECKINS_PARTITIONS_AHEAD + 1):
+        month = _add_months(current, offset)
+        if create_partition(conn, month):
+            created.append(partition_name(month))
+    return created
+
+
+def drop_expired_partitions(conn: Connection, today: date) -> List[str]:
+    """Отсоединить и удалить секции старше срока хранения; вернуть имена удаленных"""
+    if CHECKINS_RETENTION_MONTHS <= 0:
+        return []
+    cutoff = _add_months(_month_start(today), -CHECKINS_RETENTION_MONTHS)
+    cutoff_date = datetime.combine(cutoff, datetime.min.time())
+    dropped = []
+    for name, month in list_partitions(conn):
+        if month is not None and _add_months(month, 1) <= cutoff:
+            conn.execute(text(f"ALTER TABLE checkins DETACH PARTITION {name}"))
+            conn.execute(text(f"DROP TABLE {name}"))
+            dropped.append(name)
+    conn.execute(text(f"DELETE FROM {DEFAULT_PARTITION} WHERE date < :cutoff"), {"cutoff": cutoff_date})
+    # Производные таблицы не должны ссылаться на удаленные чек-ины
+    conn.execute(LatestMoodDB.__table__.delete().where(LatestMoodDB.date < cutoff_date))
+    conn.execute(MoodBucketDB.__table__.delete().where(MoodBucketDB.hour < cutoff_date))
+    return dropped
+
+
+def convert_to_partitioned(engine: Engine, today: Optional[date] = None):
+    """
+    Перевести обычную таблицу checkins на секции по месяцам
+
+    Выполняется одной транзакцией: новая секционированная таблица,
+    секции месяцев с данными (не старше CONVERT_MONTHS_BACK) и будущих
+    месяцев, копирование строк, удаление старой таблицы.
+    """
+    global _partitioned
+    today = today or datetime.now(timezone.utc).date()
+    table = CheckInDB.__table__
+    with engine.begin() as conn:
+        if is_partitioned(conn):
+            return
+        columns = ", ".join(
+            f"{column.name} {column.type.compile(dialect=conn.dialect)}{'' if column.nullable else ' NOT NULL'}"
+            for column in table.columns
+        )
+        column_names = ", ".join(column.name for column in table.columns)
+        conn.execute(text(
+            f"CREATE TABLE checkins_partitioned ({columns}, PRIMARY KEY (id, date)) PARTITION BY RANGE (date)"
+        ))
+        conn.execute(text("ALTER TABLE checkins RENAME TO checkins_legacy"))
+        conn.execute(text("ALTER TABLE checkins_partitioned RENAME TO checkins"))
+        # Имена индексов общие для схемы - индексы старой таблицы удаляются до создания новых
+        for index in table.indexes:
+            conn.execute(text(f"DROP INDEX IF EXISTS {index.name}"))
+        for index in table.indexes:
+            index.create(conn)
+
+        first_date = conn.execute(text("SELECT min(date) FROM checkins_legacy")).scalar()
+        month = _month_start(today)
+        if first_date is not None:
+            month = max(_month_start(first_date), _add_months(month, -CONVERT_MONTHS_BACK))
+        _create_default_partition(conn)
+        while month < _month_start(today):
+            create_partition(conn, month)
+            month = _add_months(month, 1)
+        ensure_partitions(conn, today)
+
+        conn.execute(text(f"INSERT INTO checkins ({column_names}) SELECT {column_names} FROM checkins_legacy"))
+        conn.execute(text("DROP TABLE checkins_legacy"))
+        conn.execute(text("ALTER TABLE checkins RENAME CONSTRAINT checkins_partitioned_pkey TO checkins_pkey"))
+    _partitioned = True
+
+
+def run_partition_maintenance(engine: Engine, today: Optional[date] = None):
+    """Создание будущих секций и удаление устаревших (задача обслуживания)"""
+    if not CHECKINS_PARTITIONING or engine.dialect.name != "postgresql":
+        return
+    today = today or datetime.now(timezone.utc).date()
+    with engine.connect() as conn:
+        partitioned = is_partitioned(conn)
+        empty = conn.execute(text("SELECT 1 FROM checkins LIMIT 1")).first() is None
+    if not partitioned:
+        if not empty:
+            print("[WARNING] CHECKINS_PARTITIONING=on, но таблица checkins не секционирована - "
+                  "выполните scripts/partition_checkins.py")
+            return
+        convert_to_partitioned(engine, today)
+        print("[INFO] Таблица checkins переведена на секции по месяцам")
+    with engine.begin() as conn:
+        created = ensure_partitions(conn, today)
+        dropped = drop_expired_partitions(conn, today)
+    if created:
+        print(f"[INFO] Созданы секции checkins: {', '.join(created)}")
+    if dropped:
+        print(f"[INFO] Удалены секции checkins старше {CHECKINS_RETENTION_MONTHS} мес.: {', '.join(dropped)}")
@@ -0,0 +1,132 @@
+"""
+Кэш рейтингов в памяти процесса
+
+- Ключ: (endpoint, period, region_id)
+- TTL и ограниченный размер с вытеснением по LRU
+- Версионирование: после записи чек-инов (create_checkin / sync_checkins)
+  все сохраненные рейтинги считаются устаревшими
+- Stale-while-revalidate: устаревший рейтинг отдается сразу,
+  а пересчет выполняется в фоне с отдельной сессией БД
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Callable, Hashable
+from sqlalchemy.orm import Session
+from app.database import ReadSessionLocal
+
+# Настройки кэша (секунды / количество записей)
+RANKING_CACHE_TTL = float(os.getenv("RANKING_CACHE_TTL", "30"))
+RANKING_CACHE_STALE_TTL = float(os.getenv("RANKING_CACHE_STALE_TTL", "300"))
+RANKING_CACHE_MAX_SIZE = int(os.getenv("RANKING_CACHE_MAX_SIZE", "256"))
+
+
+@dataclass
+class _CacheEntry:
+    """Сохраненный рейтинг"""
+    value: Any
+    created_at: float  # time.monotonic() на момент расчета
+    version: int  # Версия данных, для которой посчитан рейтинг
+
+
+class RankingCache:
+    """LRU-кэш рейтингов с TTL и фоновым пересчетом"""
+
+    def __init__(
+        self,
+        ttl: float = RANKING_CACHE_TTL,
+        stale_ttl: float = RANKING_CACHE_STALE_TTL,
+        max_size: int = RANKING_CACHE_MAX_SIZE,
+        session_factory: Callable[[], Session] = ReadSessionLocal
+    ):
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.max_size = max_size
+        self._session_factory = session_factory
+        self._entries: "OrderedDict[Hashable, _CacheEntry]" = OrderedDict()
+        self._refreshing: set = set()  # Ключи, которые сейчас пересчитываются в фоне
+        self._version = 0
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl > 0 and self.max_size > 0
+
+    def invalidate(self):
+        """Пометить все рейтинги устаревшими (вызывается после записи чек-инов)"""
+        with self._lock:
+            self._version += 1
+
+    def clear(self):
+        """Полностью очистить кэш"""
+        with self._lock:
+            self._entries.clear()
+            self._version += 1
+
+    def get_or_compute(self, key: Hashable, compute: Callable[[Session], Any], db: Session) -> Any:
+        """
+        Получить рейтинг из кэша или рассчитать его
+
+        Args:
+            key: Ключ кэша (endpoint, period, region_id)
+            compute: Функция расчета, принимает сессию БД
+            db: Сессия текущего запроса (для синхронного расчета при промахе)
+
+        Returns:
+            Рейтинг (свежий или устаревший, пока идет фоновый пересчет)
+        """
+        if not self.enabled:
+            return compute(db)
+
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                age = now - entry.created_at
+                if entry.version == self._version and age < self.ttl:
+                    return entry.value
+                if age < self.ttl + self.stale_ttl:
+                    # Отдаем устаревшее значение, пересчитываем в фоне
+                    if key not in self._refreshing:
+                        self._refreshing.add(key)
+                        threading.Thread(
+                            target=self._refresh,
+                            args=(key, compute),
+                            daemon=True
+                        ).start()
+                    return entry.value
+            version = self._version
+
+        # Значения нет (или оно слишком старое) - считаем в текущем запросе
+        value = compute(db)
+        self._store(key, value, version)
+        return value
+
+    def _refresh(self, key: Hashable, compute: Callable[[Session], Any]):
+        """Фоновый пересчет одного рейтинга"""
+        db = self._session_factory()
+        try:
+            with self._lock:
+                version = self._version
+            value = compute(db)
+            self._store(key, value, version)
+        except Exception as e:
+            print(f"[WARNING] Ошибка фонового пересчета рейтинга {key}: {e}")
+        finally:
+            db.close()
+            with self._lock:
+                self._refreshing.discard(key)
+
+    def _store(self, key: Hashable, value: Any, version: int):
+        with self._lock:
+            self._entries[key] = _CacheEntry(value=value, created_at=time.monotonic(), version=version)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+
+# Глобальный кэш рейтингов процесса
+ranking_cache = RankingCache()
@@ -0,0 +1,129 @@
+"""
+Фоновое обновление снимков рейтингов
+
+Задача asyncio, запускаемая в lifespan приложения, периодически
+пересчитывает рейтинги всех уровней за все периоды и публикует
+неизменяемые снимки. Обработчики запросов читают последний снимок,
+поэтому время ответа не зависит от размера таблиц.
+"""
+import asyncio
+import os
+import random
+import time
+from dataclasses import dataclass
+from types import MappingProxyType
+from typing import Callable, Dict, Mapping, Optional
+from sqlalchemy.orm import Session
+from app.database import ReadSessionLocal
+from app.services.statistics import compute_rankings
+
+# Интервал обновления снимков в секундах (0 - фоновое обновление выключено)
+RANKING_REFRESH_INTERVAL = float(os.getenv("RANKING_REFRESH_INTERVAL", "15"))
+# Случайный разброс интервала (доля от интервала), чтобы воркеры не считали одновременно
+RANKING_REFRESH_JITTER = float(os.getenv("RANKING_REFRESH_JITTER", "0.2"))
+
+PERIODS = ("day", "week", "month")
+
+
+@dataclass(frozen=True)
+class RankingSnapshot:
+    """Неизменяемый снимок рейтингов за период"""
+    period: str
+    rankings: Mapping  # regions / cities / cities_by_region / federal_districts
+    created_at: float  # time.time() на момент публикации
+
+    @property
+    def age(self) -> float:
+        """Возраст снимка в секундах"""
+        return time.time() - self.created_at
+
+
+def _freeze(rankings: dict) -> Mapping:
+    """Сделать результат compute_rankings доступным только для чтения"""
+    return MappingProxyType({
+        "regions": tuple(rankings["regions"]),
+        "cities": tuple(rankings["cities"]),
+        "cities_by_region": MappingProxyType({
+            region_id: tuple(cities)
+            for region_id, cities in rankings["cities_by_region"].items()
+        }),
+        "federal_districts": tuple(rankings["federal_districts"]),
+    })
+
+
+class RankingSnapshotRefresher:
+    """Периодический пересчет рейтингов в фоне"""
+
+    def __init__(
+        self,
+        interval: float = RANKING_REFRESH_INTERVAL,
+        jitter: float = RANKING_REFRESH_JITTER,
+        session_factory: Callable[[], Session] = ReadSessionLocal
+    ):
+        self.interval = interval
+        self.jitter = jitter
+        self._session_factory = session_factory
+        self._snapshots: Mapping[str, RankingSnapshot] = MappingProxyType({})
+        self._task: Optional[asyncio.Task] = None
+        self._stopping: Optional[asyncio.Event] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.interval > 0
+
+    def get(self, period: str) -> Optional[RankingSnapshot]:
+        """Последний опубликованный снимок за период (None, если его еще нет)"""
+        return self._snapshots.get(period)
+
+    def ages(self) -> Dict[str, Optional[float]]:
+        """Возраст снимков по периодам в секундах"""
+        return {
+            period: round(snapshot.age, 3) if (snapshot := self._snapshots.get(period)) else None
+            for period in PERIODS
+        }
+
+    def refresh_all(self):
+        """Пересчитать и опубликовать снимки за все периоды (синхронно)"""
+        db = self._session_factory()
+        try:
+            for period in PERIODS:
+                rankings = _freeze(compute_rankings(db, period))
+                db.rollback()  # Следующий период - по свежим данным
+                snapshot = RankingSnapshot(period=period, rankings=rankings, created_at=time.time())
+                # Публикуем новой неизменяемой копией словаря: читатели не видят частичных обновлений
+                self._snapshots = MappingProxyType({**self._snapshots, period: snapshot})
+        finally:
+            db.close()
+
+    def _next_delay(self) -> float:
+        return max(0.0, self.interval * (1 + random.uniform(-self.jitter, self.jitter)))
+
+    async def _run(self):
+        while not self._stopping.is_set():
+            try:
+                await asyncio.to_thread(self.refresh_all)
+            except Exception as e:
+                print(f"[WARNING] Ошибка обновления снимков рейтингов: {e}")
+            try:
+                await asyncio.wait_for(self._stopping.wait(), timeout=self._next_delay())
+            except asyncio.TimeoutError:
+                pass
+
+    async def start(self):
+        """Запустить фоновое обновление (вызывается в lifespan)"""
+        if not self.enabled or self._task is not None:
+            return
+        self._stopping = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Остановить фоновое обновление, дождавшись текущего пересчета"""
+        if self._task is None:
+            return
+        self._stopping.set()
+        await self._task
+        self._task = None
+
+
+# Глобальный экземпляр процесса
+ranking_snapshots = RankingSnapshotRefresher()
@@ -4,235 +4,260 @@
 from datetime import datetime, timedelta, timezone
 from sqlalchemy.orm import Session
 from sqlalchemy import func, and_
-from app.database import CheckInDB
-from app.data.region_population import get_region_population, get_city_population, get_federal_district_population
+from app.database import CheckInDB, LatestMoodDB, MoodBucketDB
+from app.services.latest_moods import LEVEL_REGION, LEVEL_CITY, LEVEL_FEDERAL_DISTRICT, MOODS
+from app.services.name_dictionary import name_dictionary
+from app.data.region_population import (
+    get_region_population,
+    get_city_population,
+    get_district_population,
+    get_federal_district_population
+)
 
 
-def get_period_filter(period: str):
-    """Получить фильтр по периоду"""
+# Размер пачки строк при потоковом чтении чек-инов
+STREAM_BATCH_SIZE = 1000
+
+
+def get_period_start(period: str):
+    """Получить начало периода (None - все время)"""
     now = datetime.now(timezone.utc)
     if period == "day":
-        return CheckInDB.date >= (now - timedelta(days=1))
+        return now - timedelta(days=1)
     elif period == "week":
-        return CheckInDB.date >= (now - timedelta(days=7))
+        return now - timedelta(days=7)
     elif period == "month":
-        return CheckInDB.date >= (now - timedelta(days=30))
+        return now - timedelta(days=30)
     else:
+        return None  # Все время
+
+
+def get_period_filter(period: str, column=CheckInDB.date):
+    """Получить фильтр по периоду"""
+    start = get_period_start(period)
+    if start is None:
         return True  # Все время
+    return column >= start
 
 
-def calculate_region_ranking(db: Session, period: str = "day"):
-    """Рассчитать рейтинг регионов
-    
-    Логика:
-    - Один пользователь может голосовать много раз за день
-    - В статистике считается как ОДИН проголосовавший
-    - Берется последний чек-ин каждого пользователя за период
+def _average(moods_sum: int, users: int) -> float:
+    return round(moods_sum / users, 2) if users else 0
+
+
+def _collect_area_histograms(db: Session, period: str):
+    """Гистограммы настроений по областям за период
+
+    Полные часы периода берутся из mood_buckets (не более 720 ячеек на область
+    за месяц), неполный первый час - из latest_moods, чтобы граница периода
+    оставалась точной.
+
+    Returns:
+        {(level, area_id): {'name': str, 'region_id': str, 'moods': [кол-во по оценкам 1-5]}}
     """
-    period_filter = get_period_filter(period)
-    
-    # Получаем все чек-ины за период с userId (обязательное поле)
-    all_checkins = db.query(CheckInDB).filter(
-        and_(
-            period_filter,
-            CheckInDB.user_id.isnot(None),
-            CheckInDB.user_id != ""
-        )
-    ).all()
-    
-    # Группируем по региону и пользователю, берем последний чек-ин каждого пользователя
-    region_user_last = {}  # {(region_id, user_id): (mood, date)}
-    
-    for checkin in all_checkins:
-        key = (checkin.region_id, checkin.user_id)
-        if key not in region_user_last:
-            region_user_last[key] = (checkin.mood, checkin.date)
-        else:
-            # Берем последний чек-ин (по дате)
-            if checkin.date > region_user_last[key][1]:
-                region_user_last[key] = (checkin.mood, checkin.date)
-    
-    # Группируем по региону и считаем статистику
-    region_stats = {}  # {region_id: {'name': str, 'moods': [int], 'users': set}}
-    
-    for (region_id, user_id), (mood, date) in region_user_last.items():
-        if region_id not in region_stats:
-            region_stats[region_id] = {
-                'name': None,
-                'moods': [],
-                'users': set()
-            }
-        region_stats[region_id]['moods'].append(mood)
-        region_stats[region_id]['users'].add(user_id)
-        # Сохраняем название региона из первого чек-ина
-        if region_stats[region_id]['name'] is None:
-            checkin = db.query(CheckInDB).filter(
-                CheckInDB.region_id == region_id
-            ).first()
-            if checkin:
-                region_stats[region_id]['name'] = checkin.region_name
-    
-    # Формируем результат
-    rankings = []
-    for region_id, stats in region_stats.items():
-        if stats['name'] is None:
-            continue
-        total_users = len(stats['users'])  # Количество уникальных пользователей
-        avg_mood = sum(stats['moods']) / len(stats['moods']) if stats['moods'] else 0
-        
-        # Получаем население региона
-        population = get_region_population(region_id)
-        rankings.append({
-            "id": region_id,
-            "name": stats['name'],
-            "averageMood": round(avg_mood, 2),
-            "totalCheckIns": total_users,  # Количество уникальных пользователей
-            "population": population,
-            "lastUpdate": datetime.now(timezone.utc).isoformat()
-        })
+    start = get_period_start(period)
+    mood_columns = [getattr(MoodBucketDB, f"mood_{mood}") for mood in MOODS]
+    
+    bucket_query = db.query(
+        MoodBucketDB.level,
+        MoodBucketDB.area_id,
+        func.max(MoodBucketDB.area_name),
+        func.max(MoodBucketDB.region_id),
+        *[func.sum(column) for column in mood_columns]
+    )
+    if start is not None:
+        first_full_hour = start.replace(minute=0, second=0, microsecond=0) + timedelta(hours=1)
+        bucket_query = bucket_query.filter(MoodBucketDB.hour >= first_full_hour)
+    bucket_rows = bucket_query.group_by(MoodBucketDB.level, MoodBucketDB.area_id).all()
+    
+    areas = {}
+    for level, area_id, name, region_id, *moods in bucket_rows:
+        areas[(level, area_id)] = {
+            'name': name,
+            'region_id': region_id,
+            'moods': [int(count or 0) for count in moods]
+        }
+    
+    if start is not None:
+        boundary_rows = db.query(
+            LatestMoodDB.level,
+            LatestMoodDB.area_id,
+            func.max(LatestMoodDB.area_name),
+            func.max(LatestMoodDB.region_id),
+            LatestMoodDB.mood,
+            func.count(LatestMoodDB.user_id)
+        ).filter(
+            LatestMoodDB.date >= start,
+            LatestMoodDB.date < first_full_hour
+        ).group_by(
+            LatestMoodDB.level, LatestMoodDB.area_id, LatestMoodDB.mood
+        ).all()
+        for level, area_id, name, region_id, mood, count in boundary_rows:
+            area = areas.setdefault((level, area_id), {
+                'name': name,
+                'region_id': region_id,
+                'moods': [0] * len(MOODS)
+            })
+            area['moods'][mood - 1] += count
     
-    # Сортируем по среднему настроению
-    rankings.sort(key=lambda x: x["averageMood"], reverse=True)
-    return rankings
+    return areas
 
 
-def calculate_city_ranking(db: Session, region_id: str = None, period: str = "day"):
-    """Рассчитать рейтинг городов
+def compute_rankings(db: Session, period: str = "day"):
+    """Рассчитать рейтинги всех уровней
     
     Логика:
     - Один пользователь может голосовать много раз за день
     - В статистике считается как ОДИН проголосовавший
     - Берется последний чек-ин каждого пользователя за период
+      (отдельно для региона, города и федерального округа)
+    
+    Последний чек-ин пользователя в каждой области хранится в latest_moods,
+    а почасовые гистограммы по ним - в mood_buckets (обновляются при записи
+    чек-инов), поэтому рейтинг собирается из агрегатов, а не из чек-инов.
+    
+    Returns:
+        {
+            "regions": [...],  # Рейтинг регионов
+            "cities": [...],  # Рейтинг всех городов
+            "cities_by_region": {region_id: [...]},  # Рейтинг городов каждого региона
+            "federal_districts": [...]  # Рейтинг федеральных округов
+        }
     """
-    period_filter = get_period_filter(period)
-    
-    # Получаем все чек-ины за период с userId (обязательное поле) и cityName
-    query = db.query(CheckInDB).filter(
-        and_(
-            period_filter,
-            CheckInDB.user_id.isnot(None),
-            CheckInDB.user_id != "",
-            CheckInDB.city_name.isnot(None),
-            CheckInDB.city_name != ""
-        )
-    )
-    
-    if region_id:
-        query = query.filter(CheckInDB.region_id == region_id)
-    
-    all_checkins = query.all()
-    
-    # Группируем по городу и пользователю, берем последний чек-ин каждого пользователя
-    city_user_last = {}  # {(city_id, city_name, region_id, user_id): (mood, date)}
-    
-    for checkin in all_checkins:
-        city_id_key = checkin.city_id or f"{checkin.region_id}_{checkin.city_name}"
-        key = (city_id_key, checkin.city_name, checkin.region_id, checkin.user_id)
-        if key not in city_user_last:
-            city_user_last[key] = (checkin.mood, checkin.date)
-        else:
-            # Берем последний чек-ин (по дате)
-            if checkin.date > city_user_last[key][1]:
-                city_user_last[key] = (checkin.mood, checkin.date)
-    
-    # Группируем по городу и считаем статистику
-    city_stats = {}  # {city_id: {'name': str, 'region_id': str, 'moods': [int], 'users': set}}
+    area_rows = []
+    for (level, area_id), area in _collect_area_histograms(db, period).items():
+        total_users = sum(area['moods'])
+        if total_users == 0:
+            continue
+        moods_sum = sum(mood * count for mood, count in zip(MOODS, area['moods']))
+        area_rows.append((level, area_id, area['name'], area['region_id'], moods_sum, total_users))
     
-    for (city_id, city_name, region_id, user_id), (mood, date) in city_user_last.items():
-        if city_id not in city_stats:
-            city_stats[city_id] = {
-                'name': city_name,
-                'region_id': region_id,
-                'moods': [],
-                'users': set()
-            }
-        city_stats[city_id]['moods'].append(mood)
-        city_stats[city_id]['users'].add(user_id)
+    last_update = datetime.now(timezone.utc).isoformat()
     
     # Формируем результат
-    rankings = []
-    for city_id, stats in city_stats.items():
-        total_users = len(stats['users'])  # Количество уникальных пользователей
-        avg_mood = sum(stats['moods']) / len(stats['moods']) if stats['moods'] else 0
-        
-        # Получаем население города из базы данных
-        population = get_city_population(stats['region_id'], stats['name'])
-        rankings.append({
-            "id": city_id,
-            "name": stats['name'],
-            "regionId": stats['region_id'],
-            "averageMood": round(avg_mood, 2),
-            "totalCheckIns": total_users,  # Количество уникальных пользователей
-            "population": population,
-            "lastUpdate": datetime.now(timezone.utc).isoformat()
-        })
+    regions = []
+    cities = []
+    cities_by_region = {}
+    federal_districts = []
+    for level, area_id, name, region_id, moods_sum, total_users in area_rows:
+        if level == LEVEL_REGION:
+            regions.append({
+                "id": area_id,
+                "name": name,
+                "averageMood": _average(moods_sum, total_users),
+                "totalCheckIns": total_users,  # Количество уникальных пользователей
+                "population": get_region_population(area_id),
+                "lastUpdate": last_update
+            })
+        elif level == LEVEL_CITY:
+            city = {
+                "id": area_id,
+                "name": name,
+                "regionId": region_id,
+                "averageMood": _average(moods_sum, total_users),
+                "totalCheckIns": total_users,  # Количество уникальных пользователей
+                # Получаем население города из базы данных
+                "population": get_city_population(region_id, name),
+                "lastUpdate": last_update
+            }
+            cities.append(city)
+            cities_by_region.setdefault(region_id, []).append(city)
+        elif level == LEVEL_FEDERAL_DISTRICT:
+            federal_districts.append({
+                "id": str(hash(area_id)),
+                "name": area_id,
+                "averageMood": _average(moods_sum, total_users),
+                "totalCheckIns": total_users,  # Количество уникальных пользователей
+                # Получаем население федерального округа из базы данных
+                "population": get_federal_district_population(area_id),
+                "lastUpdate": last_update
+            })
     
     # Сортируем по среднему настроению
-    rankings.sort(key=lambda x: x["averageMood"], reverse=True)
-    return rankings
+    by_mood = lambda x: x["averageMood"]
+    regions.sort(key=by_mood, reverse=True)
+    cities.sort(key=by_mood, reverse=True)
+    for region_cities in cities_by_region.values():
+        region_cities.sort(key=by_mood, reverse=True)
+    federal_districts.sort(key=by_mood, reverse=True)
+    
+    return {
+        "regions": regions,
+        "cities": cities,
+        "cities_by_region": cities_by_region,
+        "federal_districts": federal_districts
+    }
+
+
+def calculate_region_ranking(db: Session, period: str = "day"):
+    """Рассчитать рейтинг регионов (см. compute_rankings)"""
+    return compute_rankings(db, period)["regions"]
+
+
+def calculate_city_ranking(db: Session, region_id: str = None, period: str = "day"):
+    """Рассчитать рейтинг городов, всех или одного региона (см. compute_rankings)"""
+    rankings = compute_rankings(db, period)
+    if region_id:
+        return rankings["cities_by_region"].get(region_id, [])
+    return rankings["cities"]
 
 
 def calculate_federal_district_ranking(db: Session, period: str = "day"):
-    """Рассчитать рейтинг федеральных округов
+    """Рассчитать рейтинг федеральных округов (см. compute_rankings)"""
+    return compute_rankings(db, period)["federal_districts"]
+
+
+def calculate_district_ranking(db: Session, city_id: str, period: str = "day"):
+    """Рассчитать рейтинг районов города
     
-    Логика:
-    - Один пользователь может голосовать много раз за день
-    - В статистике считается как ОДИН проголосовавший
-    - Берется последний чек-ин каждого пользователя за период
+    Логика та же, что и у остальных рейтингов: один пользователь считается
+    один раз, берется его последний чек-ин в районе за период.
+    Запрос идет по индексу ix_checkins_city_district_date (city_id, district_id, date),
+    группировка - по ключу района, названия берутся из словаря в памяти.
     """
     period_filter = get_period_filter(period)
     
-    # Получаем все чек-ины за период с userId (обязательное поле) и federalDistrict
-    all_checkins = db.query(CheckInDB).filter(
+    rank = func.row_number().over(
+        partition_by=[CheckInDB.district_id, CheckInDB.user_id],
+        order_by=CheckInDB.date.desc()
+    )
+    latest = db.query(
+        CheckInDB.district_id,
+        CheckInDB.region_id,
+        CheckInDB.mood,
+        CheckInDB.user_id,
+        rank.label("rank")
+    ).filter(
         and_(
+            CheckInDB.city_id == city_id,
+            CheckInDB.district_id.isnot(None),
             period_filter,
             CheckInDB.user_id.isnot(None),
-            CheckInDB.user_id != "",
-            CheckInDB.federal_district.isnot(None),
-            CheckInDB.federal_district != ""
+            CheckInDB.user_id != ""
         )
-    ).all()
-    
-    # Группируем по округу и пользователю, берем последний чек-ин каждого пользователя
-    district_user_last = {}  # {(federal_district, user_id): (mood, date)}
+    ).subquery()
     
-    for checkin in all_checkins:
-        key = (checkin.federal_district, checkin.user_id)
-        if key not in district_user_last:
-            district_user_last[key] = (checkin.mood, checkin.date)
-        else:
-            # Берем последний чек-ин (по дате)
-            if checkin.date > district_user_last[key][1]:
-                district_user_last[key] = (checkin.mood, checkin.date)
+    district_rows = db.query(
+        latest.c.district_id,
+        func.max(latest.c.region_id),
+        func.avg(latest.c.mood),
+        func.count(latest.c.user_id)
+    ).filter(latest.c.rank == 1).group_by(latest.c.district_id).all()
     
-    # Группируем по округу и считаем статистику
-    district_stats = {}  # {federal_district: {'moods': [int], 'users': set}}
+    last_update = datetime.now(timezone.utc).isoformat()
     
-    for (federal_district, user_id), (mood, date) in district_user_last.items():
-        if federal_district not in district_stats:
-            district_stats[federal_district] = {
-                'moods': [],
-                'users': set()
-            }
-        district_stats[federal_district]['moods'].append(mood)
-        district_stats[federal_district]['users'].add(user_id)
-    
-    # Формируем результат
+    district_names = name_dictionary.names(db, (row[0] for row in district_rows))
     rankings = []
-    for federal_district, stats in district_stats.items():
-        total_users = len(stats['users'])  # Количество уникальных пользователей
-        avg_mood = sum(stats['moods']) / len(stats['moods']) if stats['moods'] else 0
-        
-        district_id = str(hash(federal_district))
-        # Получаем население федерального округа из базы данных
-        population = get_federal_district_population(federal_district)
+    for district_id, region_id, avg_mood, total_users in district_rows:
+        district = district_names.get(district_id)
         rankings.append({
-            "id": district_id,
-            "name": federal_district,
-            "averageMood": round(avg_mood, 2),
+            "id": f"{city_id}_{district}",
+            "name": district,
+            "cityId": city_id,
+            "averageMood": round(float(avg_mood or 0), 2),
             "totalCheckIns": total_users,  # Количество уникальных пользователей
-            "population": population,
-            "lastUpdate": datetime.now(timezone.utc).isoformat()
+            # Население района из городских округов региона
+            "population": get_district_population(region_id, district),
+            "lastUpdate": last_update
         })
     
     rankings.sort(key=lambda x: x["averageMood"], reverse=True)
@@ -249,30 +274,32 @@ def calculate_region_stats(db: Session, region_id: str, period: str = "day"):
     """
     period_filter = get_period_filter(period)
     
-    # Получаем все чек-ины за период с userId (обязательное поле) для данного региона
-    all_checkins = db.query(CheckInDB).filter(
+    # Читаем только нужные колонки кортежами и потоково (yield_per: серверный
+    # курсор на PostgreSQL), без ORM-объектов и identity map
+    checkin_rows = db.query(
+        CheckInDB.user_id,
+        CheckInDB.mood,
+        CheckInDB.date
+    ).filter(
         and_(
             period_filter,
             CheckInDB.region_id == region_id,
             CheckInDB.user_id.isnot(None),
             CheckInDB.user_id != ""
         )
-    ).all()
-    
-    if not all_checkins:
-        return None
+    ).yield_per(STREAM_BATCH_SIZE)
     
     # Группируем по пользователю, берем последний чек-ин каждого пользователя
     user_last = {}  # {user_id: (mood, date)}
     
-    for checkin in all_checkins:
-        user_id = checkin.user_id
-        if user_id not in user_last:
-            user_last[user_id] = (checkin.mood, checkin.date)
-        else:
-            # Берем последний чек-ин (по дате)
-            if checkin.date > user_last[user_id][1]:
-                user_last[user_id] = (checkin.mood, checkin.date)
+    for user_id, mood, date in checkin_rows:
+        last = user_last.get(user_id)
+        # Берем последний чек-ин (по дате)
+        if last is None or date > last[1]:
+            user_last[user_id] = (mood, date)
+    
+    if not user_last:
+        return None
     
     # Считаем статистику
     total_users = len(user_last)  # Количество уникальных пользователей
@@ -280,15 +307,19 @@ def calculate_region_stats(db: Session, region_id: str, period: str = "day"):
     avg_mood = sum(moods) / len(moods) if moods else 0
     
     # Получаем название региона
-    region = db.query(CheckInDB.region_name).filter(
+    region = db.query(CheckInDB.region_name_id).filter(
         CheckInDB.region_id == region_id
     ).first()
     
+    region_name = region_id
+    if region:
+        region_name = name_dictionary.names(db, [region.region_name_id]).get(region.region_name_id)
+    
     # Получаем население региона
     population = get_region_population(region_id)
     return {
         "id": region_id,
-        "name": region.region_name if region else region_id,
+        "name": region_name,
         "averageMood": round(avg_mood, 2),
         "totalCheckIns": total_users,  # Количество уникальных пользователей
         "population": population,
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Сравнение скорости загрузки данных о населенных пунктах: JSON и бинарный снимок
+
+Каждый способ загрузки выполняется несколько раз в этом процессе,
+выводятся минимальное и среднее время. Снимок должен быть собран заранее
+(scripts/build_settlements_snapshot.py).
+
+Запуск:
+    cd backend
+    python scripts/benchmark_settlements_load.py        # 5 повторов
+    python scripts/benchmark_settlements_load.py 20     # 20 повторов
+"""
+
+import gc
+import os
+import sys
+import time
+
+# Настройка кодировки для Windows
+if sys.platform == 'win32':
+    import io
+    sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8')
+    sys.stderr = io.TextIOWrapper(sys.stderr.buffer, encoding='utf-8')
+
+# Добавляем путь к корню проекта
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from app.data.russia_settlements import (  # noqa: E402
+    SNAPSHOT_FILE,
+    district_files,
+    load_districts_from_json
+)
+from app.data.settlements_snapshot import read_snapshot  # noqa: E402
+
+
+def measure(name, load, repeats):
+    """Выполнить load repeats раз и вывести время"""
+    timings = []
+    result = None
+    for _ in range(repeats):
+        result = None
+        gc.collect()
+        started = time.perf_counter()
+        result = load()
+        timings.append(time.perf_counter() - started)
+    settlements = sum(
+        len(region.cities) + sum(len(ud.settlements) for ud in region.urban_districts)
+        for district in result
+        for region in district.regions
+    )
+    print(f"{name:8} мин {min(timings) * 1000:8.1f} мс, среднее {sum(timings) / len(timings) * 1000:8.1f} мс "
+          f"(округов {len(result)}, населенных пунктов {settlements})")
+    return min(timings)
+
+
+def main():
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    files = district_files()
+    if not files:
+        print("Файлы app/data/districts/*.json не найдены")
+        sys.exit(1)
+    if read_snapshot(SNAPSHOT_FILE, files) is None:
+        print("Снимок отсутствует или устарел - выполните scripts/build_settlements_snapshot.py")
+        sys.exit(1)
+
+    source_size = sum(path.stat().st_size for _, path in files)
+    print(f"JSON: {source_size / 1024:.0f} КБ, снимок: {SNAPSHOT_FILE.stat().st_size / 1024:.0f} КБ, "
+          f"повторов: {repeats}")
+    json_time = measure("JSON", lambda: load_districts_from_json(files), repeats)
+    snapshot_time = measure("снимок", lambda: read_snapshot(SNAPSHOT_FILE, files), repeats)
+    print(f"Снимок быстрее в {json_time / snapshot_time:.1f} раза")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Сборка бинарного снимка данных о населенных пунктах
+
+Собирает app/data/settlements.snapshot из app/data/districts/*.json
+(формат - см. app/data/settlements_snapshot.py). Снимок привязан к версии
+Python и к исходным файлам: после изменения JSON или смены версии Python
+его нужно собрать заново, иначе данные загружаются из JSON.
+
+Запуск:
+    cd backend
+    python scripts/build_settlements_snapshot.py
+"""
+
+import os
+import sys
+import time
+
+# Настройка кодировки для Windows
+if sys.platform == 'win32':
+    import io
+    sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8')
+    sys.stderr = io.TextIOWrapper(sys.stderr.buffer, encoding='utf-8')
+
+# Добавляем путь к корню проекта
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from app.data.russia_settlements import (  # noqa: E402
+    SNAPSHOT_FILE,
+    district_files,
+    load_districts_from_json
+)
+from app.data.settlements_snapshot import read_snapshot, write_snapshot  # noqa: E402
+
+
+def main():
+    files = district_files()
+    if not files:
+        print("Файлы app/data/districts/*.json не найдены")
+        sys.exit(1)
+
+    started = time.monotonic()
+    districts = load_districts_from_json(files)
+    if len(districts) != len(files):
+        print("Не все файлы округов загрузились, снимок не собран")
+        sys.exit(1)
+    size = write_snapshot(SNAPSHOT_FILE, files, districts)
+
+    # Проверяем, что снимок читается и подходит к исходным файлам
+    if read_snapshot(SNAPSHOT_FILE, files) is None:
+        print("Собранный снимок не читается")
+        sys.exit(1)
+    source_size = sum(path.stat().st_size for _, path in files)
+    print(f"Снимок {SNAPSHOT_FILE}: округов {len(districts)}, "
+          f"{size / 1024:.0f} КБ (JSON {source_size / 1024:.0f} КБ) "
+          f"за {time.monotonic() - started:.1f} с")
+
+
+if __name__ == '__main__':
+    main()
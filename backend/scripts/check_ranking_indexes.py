@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Проверка планов запросов статистики (EXPLAIN)
+
+Выполняет функции статистики на базе из DATABASE_URL, перехватывает
+выполненные ими SQL-запросы и для каждого строит план:
+- SQLite: EXPLAIN QUERY PLAN, каждая таблица должна читаться через SEARCH по индексу
+- PostgreSQL: EXPLAIN (FORMAT JSON) с enable_seqscan = off, Seq Scan недопустим
+
+Запуск:
+    cd backend
+    python scripts/check_ranking_indexes.py
+    DATABASE_URL=postgresql://... python scripts/check_ranking_indexes.py
+
+Код возврата 1, если хотя бы один запрос читает таблицу полным сканированием.
+"""
+
+import os
+import re
+import sys
+import json
+from sqlalchemy import event
+
+# Настройка кодировки для Windows
+if sys.platform == 'win32':
+    import io
+    sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8')
+    sys.stderr = io.TextIOWrapper(sys.stderr.buffer, encoding='utf-8')
+
+# Добавляем путь к корню проекта
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from app.database import engine, init_db, SessionLocal  # noqa: E402
+from app.services import statistics, latest_moods  # noqa: E402
+
+# Таблицы, которые не должны читаться полным сканированием
+CHECKED_TABLES = ("checkins", "latest_moods", "mood_buckets")
+
+
+def capture_queries(name, func):
+    """Выполнить функцию и вернуть выполненные ею SELECT-запросы"""
+    captured = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith("SELECT"):
+            captured.append((name, statement, parameters))
+
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        db = SessionLocal()
+        try:
+            func(db)
+        finally:
+            db.close()
+    finally:
+        event.remove(engine, "before_cursor_execute", before_cursor_execute)
+    return captured
+
+
+def sqlite_problems(conn, statement, parameters):
+    """Таблицы, которые SQLite читает без поиска по индексу"""
+    plan = [row[-1] for row in conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", parameters)]
+    problems = []
+    for table in CHECKED_TABLES:
+        details = [d for d in plan if re.match(rf"^(SCAN|SEARCH) {table}\b", d)]
+        for detail in details:
+            if not detail.startswith("SEARCH"):
+                problems.append(detail)
+    return plan, problems
+
+
+def postgresql_problems(conn, statement, parameters):
+    """Таблицы, которые PostgreSQL читает через Seq Scan"""
+    conn.exec_driver_sql("SET LOCAL enable_seqscan = off")
+    result = conn.exec_driver_sql(f"EXPLAIN (FORMAT JSON) {statement}", parameters).scalar()
+    plan = result if isinstance(result, list) else json.loads(result)
+    problems = []
+
+    def walk(node):
+        relation = node.get("Relation Name")
+        if relation in CHECKED_TABLES and node.get("Node Type") == "Seq Scan":
+            problems.append(f"Seq Scan on {relation}")
+        for child in node.get("Plans", []):
+            walk(child)
+
+    walk(plan[0]["Plan"])
+    return plan, problems
+
+
+def main():
+    init_db()
+    dialect = engine.dialect.name
+
+    checks = [
+        ("calculate_region_stats", lambda db: statistics.calculate_region_stats(db, "77", "month")),
+        ("calculate_district_ranking", lambda db: statistics.calculate_district_ranking(db, "77-1", "month")),
+        ("compute_rankings", lambda db: statistics.compute_rankings(db, "month")),
+        ("latest_moods._recompute", lambda db: latest_moods._recompute(db, [
+            (latest_moods.LEVEL_REGION, "77", "+70000000000"),
+            (latest_moods.LEVEL_CITY, "77-1", "+70000000000"),
+        ])),
+    ]
+
+    failed = 0
+    for name, func in checks:
+        for query_name, statement, parameters in capture_queries(name, func):
+            if not any(table in statement for table in CHECKED_TABLES):
+                continue
+            with engine.begin() as conn:
+                if dialect == "postgresql":
+                    plan, problems = postgresql_problems(conn, statement, parameters)
+                else:
+                    plan, problems = sqlite_problems(conn, statement, parameters)
+                conn.rollback()
+            status = "OK" if not problems else "FAIL"
+            print(f"[{status}] {query_name}")
+            if dialect != "postgresql":
+                for detail in plan:
+                    print(f"       {detail}")
+            for problem in problems:
+                print(f"       !! {problem}")
+            if problems:
+                failed += 1
+
+    if failed:
+        print(f"\nЗапросов с полным сканированием: {failed}")
+        sys.exit(1)
+    print("\nВсе запросы статистики используют индексы")
+
+
+if __name__ == '__main__':
+    main()
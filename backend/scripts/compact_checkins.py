@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Сворачивание старых чек-инов в дневные сводки (checkin_daily_stats)
+
+То же, что делает задача обслуживания при CHECKINS_COMPACT_AFTER_DAYS > 0,
+но разово: удобно для первого сворачивания накопленной истории.
+
+Запуск:
+    cd backend
+    python scripts/compact_checkins.py            # старше 31 дня
+    python scripts/compact_checkins.py 90         # старше 90 дней
+"""
+
+import os
+import sys
+import time
+
+# Настройка кодировки для Windows
+if sys.platform == 'win32':
+    import io
+    sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8')
+    sys.stderr = io.TextIOWrapper(sys.stderr.buffer, encoding='utf-8')
+
+# Добавляем путь к корню проекта
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from app.database import engine, init_db  # noqa: E402
+from app.services.compaction import compact_checkins, MIN_COMPACT_AFTER_DAYS  # noqa: E402
+
+
+def main():
+    after_days = int(sys.argv[1]) if len(sys.argv) > 1 else MIN_COMPACT_AFTER_DAYS
+    init_db()
+    print(f"Сворачивание чек-инов старше {after_days} дней...")
+    started = time.monotonic()
+    result = compact_checkins(engine, after_days)
+    print(f"Свернуто дней: {result['days']}, удалено чек-инов: {result['deleted']} "
+          f"за {time.monotonic() - started:.1f} с")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Перевод таблицы checkins на секции по месяцам (PostgreSQL)
+
+Создает секционированную таблицу, секции месяцев с данными и будущих
+месяцев, копирует чек-ины и удаляет старую таблицу - одной транзакцией.
+На время копирования запись в checkins блокируется, поэтому запускайте
+при остановленном приложении.
+
+Запуск:
+    cd backend
+    DATABASE_URL=postgresql://... python scripts/partition_checkins.py
+
+После перевода задайте CHECKINS_PARTITIONING=on.
+"""
+
+import os
+import sys
+import time
+
+# Настройка кодировки для Windows
+if sys.platform == 'win32':
+    import io
+    sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8')
+    sys.stderr = io.TextIOWrapper(sys.stderr.buffer, encoding='utf-8')
+
+# Добавляем путь к корню проекта
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from sqlalchemy import text  # noqa: E402
+from app.database import engine, init_db  # noqa: E402
+from app.services.partitions import convert_to_partitioned, is_partitioned, list_partitions  # noqa: E402
+
+
+def main():
+    if engine.dialect.name != "postgresql":
+        print("Секционирование поддерживается только для PostgreSQL")
+        sys.exit(1)
+    init_db()
+    with engine.connect() as conn:
+        if is_partitioned(conn):
+            print("Таблица checkins уже секционирована")
+            return
+        count = conn.execute(text("SELECT count(*) FROM checkins")).scalar()
+
+    print(f"Перевод checkins на секции ({count} чек-инов)...")
+    started = time.monotonic()
+    convert_to_partitioned(engine)
+    print(f"Готово за {time.monotonic() - started:.1f} с")
+
+    with engine.connect() as conn:
+        for name, _ in list_partitions(conn):
+            rows = conn.execute(text(f"SELECT count(*) FROM {name}")).scalar()
+            print(f"  {name}: {rows}")
+
+
+if __name__ == '__main__':
+    main()